@@ -0,0 +1,168 @@
+"""Low-attendance alerts, raised from attendance changes.
+
+    python alerts.py                 # process what changed since the last run
+    python alerts.py --watch 60      # keep doing so every minute
+
+A trigger on attendance_summary records every student whose attendance
+changed in attendance_changes. A run only looks at those students, a chunk
+at a time, and then clears them. The cost of a run depends on how many
+students changed, not on how many there are.
+
+Each threshold is checked on its own ("reminder" below 80%, "alert" below
+75% by default). An alert is raised once, when a student first drops below
+its threshold. It stays open until the student is back at or above it, and
+is then marked resolved, so a later drop raises a new one.
+"""
+import argparse
+import os
+import sys
+import time
+from collections import namedtuple
+
+from db import connect
+
+Alert = namedtuple("Alert", "id kind threshold percent created_at")
+
+
+def parse_thresholds(text):
+    """"alert:75,reminder:80" -> (("alert", 75.0), ("reminder", 80.0))."""
+    thresholds = []
+    for part in text.split(","):
+        kind, _, value = part.strip().partition(":")
+        if not kind or not value:
+            raise ValueError("thresholds look like alert:75,reminder:80")
+        thresholds.append((kind, float(value)))
+    return tuple(thresholds)
+
+
+# kind:percent pairs; a student below percent gets an alert of that kind.
+THRESHOLDS = parse_thresholds(os.environ.get("ATTENDANCE_ALERT_THRESHOLDS",
+                                             "alert:75,reminder:80"))
+# Sessions a student must have had before alerts apply.
+MIN_SESSIONS = int(os.environ.get("ATTENDANCE_ALERT_MIN_SESSIONS", "5"))
+
+
+def init_alerts(db):
+    """Create the alert tables and change trigger if missing (part of
+    init_db; needs the tables from records.py)."""
+    exists = db.execute("SELECT 1 FROM sqlite_master WHERE name = 'attendance_changes'").fetchone()
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS alerts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL REFERENCES users (id),
+            kind TEXT NOT NULL,
+            threshold REAL NOT NULL,
+            percent REAL NOT NULL,
+            created_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now')),
+            resolved_at TEXT
+        )
+    """)
+    # at most one open alert per student and kind
+    db.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_alerts_open
+        ON alerts (user_id, kind) WHERE resolved_at IS NULL
+    """)
+    db.execute("CREATE INDEX IF NOT EXISTS idx_alerts_created ON alerts (created_at)")
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS attendance_changes (
+            user_id INTEGER PRIMARY KEY
+        )
+    """)
+    for event in ("INSERT", "UPDATE"):
+        db.execute("""
+            CREATE TRIGGER IF NOT EXISTS attendance_changes_%s AFTER %s ON attendance_summary
+            BEGIN
+                -- not OR IGNORE: an outer statement's conflict policy
+                -- would override it
+                INSERT INTO attendance_changes (user_id) SELECT new.user_id
+                WHERE NOT EXISTS (SELECT 1 FROM attendance_changes WHERE user_id = new.user_id);
+            END
+        """ % (event.lower(), event))
+    if not exists:
+        # students with attendance from before the engine existed
+        db.execute("INSERT OR IGNORE INTO attendance_changes SELECT user_id FROM attendance_summary")
+
+
+def process_changes(db, thresholds=THRESHOLDS, min_sessions=MIN_SESSIONS, chunk=500):
+    """Re-evaluate the students whose attendance changed, one transaction
+    per chunk. Returns (students evaluated, alerts raised, alerts resolved)."""
+    evaluated = raised = resolved = 0
+    while True:
+        # IMMEDIATE: no change can slip in between reading and clearing it
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            ids = [r[0] for r in db.execute(
+                "SELECT user_id FROM attendance_changes ORDER BY user_id LIMIT ?", (chunk,))]
+            if not ids:
+                db.commit()
+                return evaluated, raised, resolved
+            marks = ",".join("?" * len(ids))
+            summaries = {r[0]: (r[1], r[2]) for r in db.execute(
+                "SELECT user_id, sessions, percent FROM attendance_summary"
+                " WHERE user_id IN (%s)" % marks, ids)}
+            open_alerts = {(r[0], r[1]) for r in db.execute(
+                "SELECT user_id, kind FROM alerts WHERE resolved_at IS NULL AND user_id IN (%s)"
+                % marks, ids)}
+
+            new, fixed = [], []
+            for user_id in ids:
+                sessions, percent = summaries.get(user_id, (0, None))
+                for kind, threshold in thresholds:
+                    low = (sessions >= min_sessions and percent is not None
+                           and percent < threshold)
+                    is_open = (user_id, kind) in open_alerts
+                    if low and not is_open:
+                        new.append((user_id, kind, threshold, percent))
+                    elif not low and is_open:
+                        fixed.append((user_id, kind))
+            db.executemany("INSERT INTO alerts (user_id, kind, threshold, percent)"
+                           " VALUES (?, ?, ?, ?)", new)
+            db.executemany("UPDATE alerts SET resolved_at = strftime('%Y-%m-%d %H:%M:%f', 'now')"
+                           " WHERE user_id = ? AND kind = ? AND resolved_at IS NULL", fixed)
+            db.execute("DELETE FROM attendance_changes WHERE user_id IN (%s)" % marks, ids)
+            db.commit()
+        except BaseException:
+            db.rollback()
+            raise
+        evaluated += len(ids)
+        raised += len(new)
+        resolved += len(fixed)
+
+
+def open_alerts(db, user_id):
+    """A student's unresolved alerts, most severe (lowest threshold) first."""
+    return [Alert(*r) for r in db.execute("""
+        SELECT id, kind, threshold, percent, created_at FROM alerts
+        WHERE user_id = ? AND resolved_at IS NULL
+        ORDER BY threshold, id
+    """, (user_id,))]
+
+
+def main(argv=None):
+    import app
+
+    parser = argparse.ArgumentParser(description="Raise and resolve low-attendance alerts.")
+    parser.add_argument("--db", default=app.DATABASE, help="database file (default: %(default)s)")
+    parser.add_argument("--watch", type=float, metavar="SECONDS",
+                        help="keep running, checking for changes every SECONDS")
+    parser.add_argument("--chunk", type=int, default=500, help="students per transaction")
+    args = parser.parse_args(argv)
+
+    app.DATABASE = args.db
+    app.init_db()
+    db = connect(args.db)
+    while True:
+        start = time.perf_counter()
+        evaluated, raised, resolved = process_changes(db, chunk=args.chunk)
+        if evaluated or not args.watch:
+            print("%d student(s) evaluated: %d alert(s) raised, %d resolved in %.2fs"
+                  % (evaluated, raised, resolved, time.perf_counter() - start))
+        if not args.watch:
+            break
+        time.sleep(args.watch)
+    db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
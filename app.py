@@ -1,33 +1,118 @@
 import os
 import sqlite3
+import time
+from contextlib import contextmanager
 from functools import wraps
-from flask import Flask, render_template, request, redirect, url_for, session, flash, g
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask import (Flask, render_template, request, redirect, url_for, session, flash, g, jsonify,
+                   Response, has_request_context, before_render_template, template_rendered)
+
+from alerts import THRESHOLDS as ATTENDANCE_THRESHOLDS, init_alerts, open_alerts
+from chatlog import ChatLogWriter
+from db import ConnectionManager, connect
+from hashing import HashingService, Overloaded
+from intents import (EMPTY_REPLY, FALLBACK_REPLY, EMPTY_INTENT, FALLBACK_INTENT,
+                     ResponseCache, normalize)
+from knowledge import KnowledgeBase
+from metrics import Registry
+from recommend import RecommendationCache, init_recommendations
+from records import SummaryCache, init_records
+from risk import init_risk
+from search import backlog, init_search, search
+from spelling import load_wordlist
+from profiling import SamplingProfiler
 
 app = Flask(__name__)
 # In real deployments, use a secure environment variable instead
 app.secret_key = os.environ.get("SECRET_KEY", "dev_secret_key_change_me")
 
 DATABASE = "database.db"
+# The chatbot's rules; edits are picked up without a restart.
+INTENTS_FILE = os.environ.get(
+    "CHATBOT_INTENTS_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "intents.json"))
+# Seconds between checks of INTENTS_FILE for changes (0 turns reloading off).
+INTENTS_RELOAD_INTERVAL = float(os.environ.get("CHATBOT_INTENTS_RELOAD_INTERVAL", "2"))
+# Chat messages shown per page on /chatbot.
+CHAT_PAGE_SIZE = int(os.environ.get("CHAT_PAGE_SIZE", "20"))
+# "substring" keeps the original keyword-anywhere matching; "token" only
+# matches whole words (so "hi" doesn't fire inside "this").
+MATCH_MODE = os.environ.get("CHATBOT_MATCH_MODE", "substring")
+# Leave rules that can never match out of the compiled matcher (replies are
+# unchanged; see shadowing.py).
+PRUNE_RULES = os.environ.get("CHATBOT_PRUNE_RULES", "1") != "0"
+# Number of distinct messages whose replies are kept in memory.
+REPLY_CACHE_SIZE = int(os.environ.get("CHATBOT_CACHE_SIZE", "1024"))
+# Most typos (edits) corrected per word when no keyword matches a message
+# as typed; 0 turns typo correction off.
+TYPO_MAX_DISTANCE = int(os.environ.get("CHATBOT_TYPO_MAX_DISTANCE", "2"))
+# Words never taken for typos: the common words shipped in words.txt, plus
+# those of an optional larger wordlist (missing file: none).
+COMMON_WORDS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "words.txt")
+WORDLIST = os.environ.get("CHATBOT_WORDLIST", "/usr/share/dict/words")
+# Minimum TF-IDF cosine similarity for the semantic fallback to answer a
+# message no keyword rule matched (needs numpy and scipy).
+SEMANTIC_THRESHOLD = float(os.environ.get("CHATBOT_SEMANTIC_THRESHOLD", "0.35"))
+# Intents answered with the student's own course recommendations (see
+# recommend.py) instead of the canned reply.
+RECOMMEND_INTENTS = frozenset(os.environ.get(
+    "CHATBOT_RECOMMEND_INTENTS", "ml_recommendation,course_recommendation").split(","))
+# Intents answered with the student's own attendance and marks, and which
+# figures each one gets.
+STUDENT_DATA_INTENTS = {
+    "attendance_related": "attendance",
+    "low_attendance": "attendance",
+    "marks": "marks",
+    "low_marks": "marks",
+    "high_marks": "marks",
+    "performance": "performance",
+    "performance_warning": "performance",
+    "course_progress": "progress",
+}
+# Seconds a student's attendance and marks totals are reused at most, and
+# how often to look for students whose records changed (by any process)
+# so their cached totals are dropped sooner.
+STUDENT_DATA_TTL = float(os.environ.get("CHATBOT_STUDENT_DATA_TTL", "60"))
+STUDENT_DATA_CHECK_INTERVAL = float(os.environ.get("CHATBOT_STUDENT_DATA_CHECK_INTERVAL", "2"))
+# Most messages /api/chat answers in one call.
+CHAT_API_MAX_BATCH = int(os.environ.get("CHAT_API_MAX_BATCH", "100"))
+# Results per page on /admin/search.
+SEARCH_PAGE_SIZE = int(os.environ.get("SEARCH_PAGE_SIZE", "20"))
+# Chat log records waiting to be written before new ones are dropped, and
+# the most written per commit (see chatlog.py).
+CHAT_LOG_QUEUE_SIZE = int(os.environ.get("CHAT_LOG_QUEUE_SIZE", "10000"))
+CHAT_LOG_BATCH_SIZE = int(os.environ.get("CHAT_LOG_BATCH_SIZE", "500"))
+# Seconds the writer waits to fill a batch before committing what it has.
+CHAT_LOG_FLUSH_INTERVAL = float(os.environ.get("CHAT_LOG_FLUSH_INTERVAL", "1"))
+# Seconds a request may wait for room in a full queue (0 = drop at once).
+CHAT_LOG_BLOCK_TIMEOUT = float(os.environ.get("CHAT_LOG_BLOCK_TIMEOUT", "0"))
+# Record request timings and serve them on /metrics ("0" turns both off).
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") != "0"
+# Fraction of requests profiled from startup (0 = off until an admin turns
+# it on at /admin/profiler).
+PROFILE_RATE = float(os.environ.get("PROFILE_RATE", "0"))
+# Where profiles are written.
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+# Comma-separated usernames allowed on the /admin pages.
+ADMIN_USERS = frozenset(u.strip() for u in os.environ.get("ADMIN_USERS", "").split(",") if u.strip())
 
 # ---------- Database helpers ----------
+connections = ConnectionManager()
+
 def get_db():
-    """Open a connection (one per request)."""
+    """Return this request's connection, borrowed from the pool (see db.py)."""
     if "db" not in g:
-        g.db = sqlite3.connect(DATABASE)
-        g.db.row_factory = sqlite3.Row
+        g.db = connections.get(DATABASE)
     return g.db
 
 @app.teardown_appcontext
 def close_db(exc):
-    """Close database connection after request."""
+    """Hand the connection back to the pool; it stays open for the next request."""
     db = g.pop("db", None)
     if db is not None:
-        db.close()
+        connections.release(db)
 
 def init_db():
-    """Create users table if it doesn't exist."""
-    db = sqlite3.connect(DATABASE)
+    """Create the users, chat, attendance, marks and alert tables if they don't exist."""
+    db = connect(DATABASE)
     c = db.cursor()
     c.execute("""
         CREATE TABLE IF NOT EXISTS users (
@@ -36,9 +121,93 @@ def init_db():
             password TEXT NOT NULL
         )
     """)
+    # sender is "You" or "Bot"; created_at has millisecond resolution and
+    # ties are broken by id
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS chat_messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL REFERENCES users (id),
+            sender TEXT NOT NULL,
+            message TEXT NOT NULL,
+            created_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now'))
+        )
+    """)
+    c.execute("""
+        CREATE INDEX IF NOT EXISTS idx_chat_messages_user_created
+        ON chat_messages (user_id, created_at)
+    """)
+    # every exchange with the intent that answered it, for analytics;
+    # written in the background by chat_log
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS chat_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            message TEXT NOT NULL,
+            intent TEXT NOT NULL,
+            created_at TEXT NOT NULL
+        )
+    """)
+    c.execute("""
+        CREATE INDEX IF NOT EXISTS idx_chat_log_intent_created
+        ON chat_log (intent, created_at)
+    """)
+    # full-text index over chat_messages, kept current by triggers
+    init_search(db)
+    # attendance and marks, with per-student summaries; see records.py
+    init_records(db)
+    # low-attendance alerts, raised by "python alerts.py"
+    init_alerts(db)
+    # course recommendations, rebuilt by "python recommend.py"
+    init_recommendations(db)
+    # student risk scores, computed by "python risk.py"
+    init_risk(db)
     db.commit()
     db.close()
 
+def save_messages(db, user_id, messages):
+    """Append (sender, text) pairs to a user's chat history."""
+    db.executemany(
+        "INSERT INTO chat_messages (user_id, sender, message) VALUES (?, ?, ?)",
+        [(user_id, sender, text) for sender, text in messages],
+    )
+    db.commit()
+
+def recent_messages(db, user_id, before=None, limit=None):
+    """Return up to `limit` of a user's messages, oldest first, and the id to
+    pass as `before` for the previous page (None when there is none).
+
+    Keyset pagination: each page starts right below the (created_at, id) of
+    the oldest message already shown, so every page costs the same index
+    range scan however long the conversation is.
+    """
+    limit = limit or CHAT_PAGE_SIZE
+    if before is None:
+        rows = db.execute("""
+            SELECT id, sender, message FROM chat_messages
+            WHERE user_id = ?
+            ORDER BY created_at DESC, id DESC
+            LIMIT ?
+        """, (user_id, limit + 1)).fetchall()
+    else:
+        rows = db.execute("""
+            SELECT id, sender, message FROM chat_messages
+            WHERE user_id = ?
+              AND (created_at, id) < (SELECT created_at, id FROM chat_messages
+                                      WHERE id = ? AND user_id = ?)
+            ORDER BY created_at DESC, id DESC
+            LIMIT ?
+        """, (user_id, before, user_id, limit + 1)).fetchall()
+    older = rows[limit - 1]["id"] if len(rows) > limit else None
+    return [(r["sender"], r["message"]) for r in reversed(rows[:limit])], older
+
+# Exchanges go to the chat_log table from a background thread; see chatlog.py.
+chat_log = ChatLogWriter(lambda: DATABASE, CHAT_LOG_QUEUE_SIZE, CHAT_LOG_BATCH_SIZE,
+                         CHAT_LOG_FLUSH_INTERVAL, CHAT_LOG_BLOCK_TIMEOUT)
+
+# ---------- Password hashing ----------
+# Runs in a separate process pool; see hashing.py for the settings.
+hasher = HashingService()
+
 # ---------- Simple login helper ----------
 def login_required(f):
     @wraps(f)
@@ -49,819 +218,250 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated
 
-# ---------- Simple AI-ish response function ----------
-def simple_ai_response(text: str) -> str:
-    t = text.lower().strip()
-
-if not t:
-        return "Please type a question so I can help you."
-
-    # 1. Greetings
-    if "hello" in t or "hi" in t or "hey" in t:
-        return "Hello 👋! How can I assist you today?"
-
-    # 2. Basic course info
-    if "course" in t or "courses" in t:
-        return "We offer Python, Web Development, Data Science, Machine Learning, Java, and more."
-
-    # 3. Project help
-    if "project" in t:
-        return "For projects, pick a topic you like, break it into sections, research each part, and build step-by-step."
-
-    # 4. Registration
-    if "register" in t or "signup" in t:
-        return "To register, go to the Register page, fill your details, and create a strong password."
-
-    # 5. Thanks
-    if "thank" in t:
-        return "You're welcome 😊! Let me know if you need more help."
-
-    # 6. Goodbye
-    if "bye" in t or "logout" in t:
-        return "Goodbye 👋! Study well and come back anytime."
-
-    # 7. ML Recommendation
-    if "recommend" in t or "suggest" in t:
-        return "Based on your learning pattern, I recommend focusing on Python fundamentals and practicing daily."
-
-    # 8. Attendance-related
-    if "attendance" in t:
-        return "Your attendance must be above 75% to avoid academic alerts."
-
-    # 9. Low attendance
-    if "low attendance" in t or "attendance drop" in t:
-        return "Your attendance is low. Please attend upcoming classes regularly to avoid warnings."
-
-    # 10. Performance
-    if "performance" in t or "result" in t:
-        return "Your recent performance shows improvement. Keep solving assignments regularly."
-
-    # 11. How to improve
-    if "improve" in t:
-        return "To improve academically, revise notes daily and solve previous assignments."
-
-    # 12. Study material
-    if "material" in t or "notes" in t:
-        return "Study materials are available in the Resources tab of your dashboard."
-
-    # 13. Dashboard
-    if "dashboard" in t:
-        return "Your student dashboard shows your performance graph, attendance, and course progress."
-
-    # 14. Admin dashboard
-    if "admin" in t:
-        return "The admin dashboard helps manage students, performance, and attendance alerts."
-
-    # 15. Forgot password
-    if "forgot" in t and "password" in t:
-        return "Click the 'Forgot Password' option on the login page to reset it."
-
-    # 16. Login issue
-    if "login" in t or "can't login" in t:
-        return "Make sure your username and password are correct. If not, reset your password."
-
-    # 17. Student login credentials info
-    if "student login" in t:
-        return "Use your student ID and password to log in to your dashboard."
-
-    # 18. Admin credentials
-    if "admin login" in t:
-        return "Only admins with verified credentials can access the admin panel."
-
-    # 19. Attendance meaning
-    if "what is attendance" in t:
-        return "Attendance represents class participation percentage. Stay above 75%."
-
-    # 20. Course timing
-    if "timing" in t or "schedule" in t:
-        return "Classes are available in morning, afternoon, and evening batches."
-
-    # 21. When is next class?
-    if "next class" in t:
-        return "Check your dashboard calendar for your next class schedule."
-
-    # 22. Assignments
-    if "assignment" in t:
-        return "Assignments are released weekly. Submit on time for best performance."
-
-    # 23. Late submission
-    if "late" in t and "assignment" in t:
-        return "Late submissions may receive reduced marks. Please inform your instructor."
-
-    # 24. Exams
-    if "exam" in t:
-        return "Exams are conducted online with multiple-choice and programming tasks."
-
-    # 25. Exam date
-    if "exam date" in t:
-        return "Your exam date is available in the Exam Schedule section."
-
-    # 26. Study tips
-    if "study tips" in t or "how to study" in t:
-        return "Follow a daily study plan, practice coding, and revise previous lessons."
-
-    # 27. Career guidance
-    if "career" in t or "future" in t:
-        return "Based on your skills, careers like Data Analyst, Web Developer, or ML Engineer suit you."
-
-    # 28. Machine learning
-    if "machine learning" in t:
-        return "ML is about making computers learn from data. Start with Python and linear regression."
-
-    # 29. Python help
-    if "python" in t:
-        return "Python is beginner-friendly. Start with variables, loops, functions, and file handling."
-
-    # 30. Java help
-    if "java" in t:
-        return "Java is great for OOP and enterprise apps. Practice classes and objects daily."
-
-    # 31. C programming help
-    if "c program" in t or "c language" in t:
-        return "C language is great for logic building. Start with variables, loops, and arrays."
-
-    # 32. C++ programming help
-    if "c++" in t or "cpp" in t:
-        return "C++ is useful for competitive programming. Practice OOP concepts and STL."
-
-    # 33. HTML help
-    if "html" in t:
-        return "HTML is the structure of web pages. Start with tags, forms, and basic layouts."
-
-    # 34. CSS help
-    if "css" in t:
-        return "CSS controls styling. Learn selectors, flexbox, grid, and responsive design."
-
-    # 35. JavaScript help
-    if "javascript" in t or "js" in t:
-        return "JavaScript powers web interactivity. Begin with variables, events, and DOM."
-
-    # 36. Data science info
-    if "data science" in t:
-        return "Data Science combines statistics and programming. Start with Python and pandas."
-
-    # 37. AI help
-    if "ai" in t or "artificial intelligence" in t:
-        return "AI focuses on building intelligent systems. Learn Python, ML, and neural networks."
-
-    # 38. Deep learning
-    if "deep learning" in t:
-        return "Deep learning uses neural networks for AI. Begin with TensorFlow or PyTorch."
-
-    # 39. Database help
-    if "database" in t or "sql" in t:
-        return "SQL manages data. Learn SELECT, INSERT, UPDATE, DELETE, and JOIN queries."
-
-    # 40. MySQL help
-    if "mysql" in t:
-        return "MySQL is a relational database. Practice table creation and CRUD operations."
-
-    # 41. SQLite help
-    if "sqlite" in t:
-        return "SQLite is lightweight and perfect for local apps. No server installation needed."
-
-    # 42. Flask help
-    if "flask" in t:
-        return "Flask is a Python web framework. Learn routing, templates, and forms."
-
-    # 43. Django help
-    if "django" in t:
-        return "Django is a powerful backend framework. Start with models, views, and templates."
-
-    # 44. API meaning
-    if "api" in t:
-        return "API allows systems to communicate. Learn GET, POST, PUT, DELETE methods."
-
-    # 45. Debugging help
-    if "debug" in t or "error" in t:
-        return "Debugging involves checking code line by line. Review errors carefully."
-
-    # 46. IDE recommendation
-    if "ide" in t or "editor" in t:
-        return "VS Code is recommended. It's lightweight and supports many languages."
-
-    # 47. Learning path
-    if "learning path" in t or "roadmap" in t:
-        return "Start slow, follow a roadmap, practice daily, and build mini projects."
-
-    # 48. Time management
-    if "time management" in t:
-        return "Use a study schedule and break tasks into smaller pieces."
-
-    # 49. Stress
-    if "stress" in t or "tired" in t:
-        return "Take breaks, sleep well, and study in sessions to avoid burnout."
-
-    # 50. Motivation
-    if "motivate" in t or "motivation" in t:
-        return "Stay consistent. Small daily learning leads to big success!"
-
-    # 51. Online class link
-    if "class link" in t:
-        return "Your class link is available on the student dashboard."
-
-    # 52. Marks
-    if "marks" in t or "score" in t:
-        return "Your marks are updated after evaluation. Check the results section."
-
-    # 53. Low marks
-    if "low marks" in t or "bad score" in t:
-        return "Don't worry. Review mistakes and practice similar questions."
-
-    # 54. High marks
-    if "high marks" in t or "good score" in t:
-        return "Great job! Keep performing consistently."
-
-    # 55. Performance warning
-    if "warning" in t:
-        return "Your performance needs attention. Focus on assignments and attendance."
-
-    # 56. Password change
-    if "change password" in t:
-        return "Go to settings and update your password in the security section."
-
-    # 57. Email issue
-    if "email" in t and "issue" in t:
-        return "Check your spam folder, and ensure you entered the correct email."
-
-    # 58. Contact admin
-    if "contact admin" in t:
-        return "You can reach admin through the Contact Admin page."
-
-    # 59. Profile update
-    if "update profile" in t or "edit profile" in t:
-        return "You can edit your profile details under the Profile Settings page."
-
-    # 60. Mobile app
-    if "app" in t or "mobile" in t:
-        return "Our mobile app is in development and will be released soon."
-
-    # 61. Course completion
-    if "complete course" in t or "course completed" in t:
-        return "Once you complete a course, your certificate will be generated automatically."
-
-    # 62. Certificate download
-    if "download certificate" in t or "certificate" in t:
-        return "You can download your certificate from the Certificates section in your dashboard."
-
-    # 63. Course progress
-    if "progress" in t:
-        return "Your course progress is updated daily. Check the progress bar for details."
-
-    # 64. Extra classes
-    if "extra class" in t or "special class" in t:
-        return "Extra classes are scheduled for students who need additional support."
-
-    # 65. Doubt session
-    if "doubt" in t or "help session" in t:
-        return "Doubt-clearing sessions happen every Friday."
-
-    # 66. Holidays information
-    if "holiday" in t or "vacation" in t:
-        return "The holiday list is available in your dashboard."
-
-    # 67. Fees
-    if "fee" in t or "fees" in t:
-        return "Fees vary by course. Check the Fees section for course-wise charges."
-
-    # 68. Refund policy
-    if "refund" in t:
-        return "Refunds are available only within the first 3 days of enrollment."
-
-    # 69. Payment methods
-    if "payment" in t or "pay" in t:
-        return "We accept UPI, net banking, debit/credit cards, and wallets."
-
-    # 70. Installment option
-    if "installment" in t:
-        return "Installment options are available for selected long-term courses."
-
-    # 71. Classroom rules
-    if "rules" in t:
-        return "Maintain discipline, attend regularly, and submit assignments on time."
-
-    # 72. Study hours
-    if "study hours" in t:
-        return "Study at least 1–2 hours daily for consistent improvement."
-
-    # 73. Group study
-    if "group study" in t:
-        return "Group study can help, but ensure you focus on your weak areas."
-
-    # 74. Self-study
-    if "self study" in t:
-        return "Self-study strengthens your understanding. Set a fixed schedule."
-
-    # 75. Internet issues
-    if "internet" in t or "wifi" in t:
-        return "Please ensure a stable internet connection for smooth learning."
-
-    # 76. Laptop requirements
-    if "laptop" in t or "system" in t:
-        return "A basic laptop with 4–8GB RAM is enough for most courses."
-
-    # 77. Phone usage
-    if "phone" in t or "mobile" in t:
-        return "You can attend classes on mobile, but coding works best on a laptop."
-
-    # 78. Slow performance
-    if "slow" in t or "lag" in t:
-        return "Restart your system and close unnecessary apps for better performance."
-
-    # 79. Update browser
-    if "browser" in t:
-        return "Please use the latest version of Chrome, Edge, or Firefox."
-
-    # 80. Video not playing
-    if "video" in t or "class video" in t:
-        return "Try refreshing the page or checking your internet speed."
-
-    # 81. Audio issue
-    if "audio" in t or "sound" in t:
-        return "Ensure your speakers or headphones are properly connected."
-
-    # 82. Camera issue
-    if "camera" in t or "webcam" in t:
-        return "Give your browser permission to access the camera."
-
-    # 83. Microphone issue
-    if "mic" in t or "microphone" in t:
-        return "Allow microphone access and check sound settings."
-
-    # 84. Attendance correction
-    if "correct attendance" in t:
-        return "Contact your instructor for manual attendance correction."
-
-    # 85. Wrong marks
-    if "wrong marks" in t or "marks mistake" in t:
-        return "Report the issue to your instructor or admin for correction."
-
-    # 86. Reset progress
-    if "reset progress" in t:
-        return "Progress can only be reset manually by an admin."
-
-    # 87. New courses
-    if "new course" in t:
-        return "New courses are added every month. Check the Updates section."
-
-    # 88. Course difficulty
-    if "difficulty" in t or "hard" in t:
-        return "Start with basics and practice regularly. Ask for help if needed."
-
-    # 89. Easy subjects
-    if "easy subject" in t:
-        return "HTML, CSS, and Python basics are great choices for beginners."
-
-    # 90. Hard subjects
-    if "hard subject" in t:
-        return "Subjects like AI, ML, and Data Science need consistent practice."
-
-    # 91. Revision advice
-    if "revision" in t or "revise" in t:
-        return "Revise your notes every weekend to strengthen your understanding."
-
-    # 92. Daily schedule
-    if "daily schedule" in t or "routine" in t:
-        return "Follow a routine: 1 hour study + 30 minutes practice + 10 minutes review."
-
-    # 93. Breaks
-    if "break" in t or "rest" in t:
-        return "Take short breaks every 45 minutes to improve focus."
-
-    # 94. Memory improvement
-    if "memory" in t or "remember" in t:
-        return "Write short notes and revise them regularly to improve memory."
-
-    # 95. Performance alerts
-    if "alert" in t:
-        return "Alerts notify students about attendance drops or low performance."
-
-    # 96. Attendance report
-    if "attendance report" in t:
-        return "Your attendance report is available in the Attendance section."
-
-    # 97. Performance report
-    if "performance report" in t:
-        return "Your performance report shows subject-wise strengths and weaknesses."
-
-    # 98. Subject weakness
-    if "weak" in t:
-        return "Identify weak subjects and practice them more frequently."
-
-    # 99. Subject strength
-    if "strong" in t:
-        return "Great! Use your strong subjects to boost overall performance."
-
-    # 100. Internet speed
-    if "speed" in t:
-        return "A minimum of 5 Mbps internet speed is recommended."
-
-    # 101. Quiz help
-    if "quiz" in t:
-        return "Quizzes help test your knowledge. Attempt them regularly."
-
-    # 102. Test preparation
-    if "prepare" in t or "preparation" in t:
-        return "Start preparing early. Revise notes and solve past questions."
-
-    # 103. Exam results
-    if "result" in t:
-        return "Results are updated once evaluations are complete."
-
-    # 104. Skills recommendation
-    if "skills" in t:
-        return "Improve your skills by practicing coding, reading PDFs, and watching lectures."
-
-    # 105. Internship eligibility
-    if "eligible for internship" in t:
-        return "You become eligible for internships after completing 70% of your course."
-
-    # 106. Job placement
-    if "job" in t or "placement" in t:
-        return "We offer placement guidance and resume-building support."
-
-    # 107. Resume help
-    if "resume" in t or "cv" in t:
-        return "Upload your resume in the Resume Builder section for feedback."
-
-    # 108. Portfolio tips
-    if "portfolio" in t:
-        return "Create a portfolio with your best projects to impress recruiters."
-
-    # 109. Project ideas
-    if "project idea" in t:
-        return "Try building a weather app, chatbot, attendance system, or portfolio website."
-
-    # 110. Coding practice
-    if "coding" in t or "code" in t:
-        return "Practice coding daily to improve your problem-solving skills."
-
-    # 111. Practice websites
-    if "practice website" in t:
-        return "You can practice coding on HackerRank, CodeChef, and LeetCode."
-
-    # 112. Lab timing
-    if "lab timing" in t:
-        return "Labs are available 24/7 for students to practice."
-
-    # 113. Attendance reminder
-    if "remind" in t or "reminder" in t:
-        return "We send reminders when your attendance drops below 80%."
-
-    # 114. Leave application
-    if "leave" in t:
-        return "Submit your leave request through the Leave Application section."
-
-    # 115. Class recording
-    if "recording" in t or "recorded class" in t:
-        return "Class recordings are uploaded within 24 hours."
-
-    # 116. Batch change
-    if "batch change" in t or "change batch" in t:
-        return "You can request a batch change once per course."
-
-    # 117. Course upgrade
-    if "upgrade course" in t:
-        return "You can upgrade your course from the Payments section."
-
-    # 118. Course downgrade
-    if "downgrade" in t:
-        return "Course downgrades require admin approval."
-
-    # 119. Contact teacher
-    if "contact teacher" in t or "message teacher" in t:
-        return "Use the Messages section to contact your teacher."
-
-    # 120. Contact support
-    if "support" in t:
-        return "Our support team is available 9AM–9PM daily for assistance."
-
-    # 121. Technical support
-    if "technical issue" in t or "tech problem" in t:
-        return "Please describe your technical issue. I’ll guide you through the solution."
-
-    # 122. Forgot username
-    if "forgot username" in t:
-        return "Contact support to retrieve your username."
-
-    # 123. Reset email
-    if "change email" in t or "update email" in t:
-        return "You can update your email in the Profile Settings."
-
-    # 124. Wrong email
-    if "wrong email" in t:
-        return "Please enter the correct email or contact support for correction."
-
-    # 125. Profile photo
-    if "profile picture" in t or "photo" in t:
-        return "Upload your profile picture in the Profile section."
-
-    # 126. Notification settings
-    if "notifications" in t:
-        return "You can enable or disable notifications in Settings."
-
-    # 127. Email verification
-    if "verify email" in t:
-        return "A verification link has been sent to your email. Please check your inbox."
-
-    # 128. Account locked
-    if "account locked" in t:
-        return "Your account was locked due to multiple failed attempts. Contact support to unlock."
-
-    # 129. Two-factor authentication
-    if "2fa" in t or "two factor" in t:
-        return "Two-factor authentication adds extra security to your account."
-
-    # 130. Update password
-    if "update password" in t:
-        return "Go to security settings and update your password safely."
-
-    # 131. Marks improvement tips
-    if "improve marks" in t:
-        return "Practice past papers and revise weekly to improve marks."
-
-    # 132. Weak attendance
-    if "weak attendance" in t:
-        return "Attend upcoming classes regularly to improve your attendance."
-
-    # 133. Performance analytics
-    if "analytics" in t:
-        return "Performance analytics show your progress, accuracy, and learning trends."
-
-    # 134. Course recommendation
-    if "which course" in t:
-        return "I recommend Data Science or Web Development based on current student trends."
-
-    # 135. Beginner course
-    if "beginner" in t:
-        return "Start with Python basics, HTML, CSS, and simple projects."
-
-    # 136. Advanced course
-    if "advanced" in t:
-        return "For advanced learning, try AI, ML, and full-stack development."
-
-    # 137. Chatbot help
-    if "chatbot" in t:
-        return "Our chatbot helps with academic queries, performance updates, and general support."
-
-    # 138. Server issue
-    if "server" in t:
-        return "The server may be updating. Please try again after a few minutes."
-
-    # 139. Page not loading
-    if "page not load" in t or "page not opening" in t:
-        return "Refresh the page or clear your browser cache."
-
-    # 140. App crashing
-    if "crash" in t:
-        return "Restart the app and check for updates."
-
-    # 141. Update app
-    if "update app" in t:
-        return "Updates improve performance. Please install the latest app version."
-
-    # 142. Video quality
-    if "quality" in t or "blurry" in t:
-        return "Adjust the video quality settings or check your internet speed."
-
-    # 143. Exam rules
-    if "exam rules" in t:
-        return "Follow exam rules: no cheating, camera on, and stable internet."
-
-    # 144. Exam time
-    if "exam time" in t:
-        return "Exam times vary for each subject. Refer to the exam schedule."
-
-    # 145. Assignment deadline
-    if "deadline" in t:
-        return "Assignment deadlines are shown in the Assignments tab."
-
-    # 146. Submission failed
-    if "submission failed" in t or "cannot submit" in t:
-        return "Try uploading the file again or reduce its size."
-
-    # 147. File size limit
-    if "file size" in t:
-        return "The maximum file size allowed is 10MB."
-
-    # 148. Plagiarism
-    if "plagiarism" in t or "copy" in t:
-        return "Please submit original work. Plagiarism can reduce your marks."
-
-    # 149. Project submission
-    if "project submit" in t:
-        return "Submit your project in the Projects section before the deadline."
-
-    # 150. Project feedback
-    if "project feedback" in t:
-        return "Project feedback will be available within 3–5 days after submission."
-
-    # 151. Teacher feedback
-    if "teacher feedback" in t:
-        return "Teacher feedback helps you understand your strengths and weaknesses."
-
-    # 152. Re-evaluation
-    if "recheck" in t or "reevaluate" in t:
-        return "You can request re-evaluation through the Marks section."
-
-    # 153. Unit test schedule
-    if "unit test" in t:
-        return "Unit test dates are available in the Exam Schedule section."
-
-    # 154. Study strategy
-    if "strategy" in t or "plan" in t:
-        return "Use the 50-10 study rule: 50 minutes study, 10 minutes break."
-
-    # 155. Class timings change
-    if "change timing" in t or "class time change" in t:
-        return "Timing changes require approval from your instructor."
-
-    # 156. New announcement
-    if "announcement" in t:
-        return "New announcements are posted on your student dashboard."
-
-    # 157. Update profile photo
-    if "change photo" in t:
-        return "Go to profile settings and upload a new picture."
-
-    # 158. Course language
-    if "language" in t:
-        return "Courses are available in English and will support more languages soon."
-
-    # 159. Online exam
-    if "online exam" in t:
-        return "Online exams require a stable internet connection and camera access."
-
-    # 160. Exam instructions
-    if "instructions" in t:
-        return "Read exam instructions carefully before starting."
-
-    # 161. Attendance marking time
-    if "mark attendance" in t:
-        return "Attendance is marked automatically when you join class."
-
-    # 162. Exam syllabus
-    if "syllabus" in t:
-        return "Your syllabus is available in the Subjects section."
-
-    # 163. Python projects
-    if "python project" in t:
-        return "Try building a calculator, chatbot, or student management system."
-
-    # 164. Web development projects
-    if "web project" in t or "website project" in t:
-        return "Try creating a portfolio website, login system, or gallery page."
-
-    # 165. Data science projects
-    if "data science project" in t:
-        return "Start with simple projects like Titanic survival prediction or sales forecasting."
-
-    # 166. Internship certificate
-    if "internship certificate" in t:
-        return "Internship certificates are provided after successful completion."
-
-    # 167. Attendance improvement tips
-    if "attendance improve" in t:
-        return "Attend regularly and avoid missing continuous classes."
-
-    # 168. Study hours suggestion
-    if "how many hours" in t:
-        return "Study at least 1–2 hours daily for best results."
-
-    # 169. Eligibility
-    if "eligible" in t:
-        return "Eligibility depends on your attendance and academic performance."
-
-    # 170. Project partner
-    if "partner" in t or "group project" in t:
-        return "You may choose a partner for group projects with teacher approval."
-
-    # 171. Extra credit
-    if "extra credit" in t:
-        return "Extra credit is awarded for active participation and project excellence."
-
-    # 172. Missing files
-    if "file missing" in t:
-        return "Try re-uploading the file. If the issue continues, contact support."
-
-    # 173. Update marks
-    if "update marks" in t or "change marks" in t:
-        return "Marks can only be updated by the instructor."
-
-    # 174. Wrong question
-    if "wrong question" in t:
-        return "Report the wrong question to your instructor immediately."
-
-    # 175. Upload photo
-    if "upload photo" in t:
-        return "Use the Upload section to add your photo."
-
-    # 176. Notifications on
-    if "turn on notifications" in t:
-        return "Enable notifications in Settings > Notifications."
-
-    # 177. Notifications off
-    if "turn off notifications" in t:
-        return "Disable notifications in Settings > Notifications."
-
-    # 178. Dashboard error
-    if "dashboard error" in t:
-        return "Please refresh the dashboard or clear your browser cache."
-
-    # 179. Password strength
-    if "strong password" in t:
-        return "Use at least 8 characters with a mix of letters, numbers, and symbols."
-
-    # 180. File format
-    if "file format" in t:
-        return "Upload files in PDF, JPG, PNG, or DOCX format."
-
-    # 181. Class attendance time
-    if "when attendance" in t:
-        return "Attendance is marked within the first 10 minutes of class."
-
-    # 182. Device support
-    if "device" in t:
-        return "You can use mobile, laptop, or tablet for online classes."
-
-    # 183. Reset settings
-    if "reset settings" in t:
-        return "You can reset settings from the Profile > Reset Settings option."
-
-    # 184. Join meeting
-    if "join meeting" in t or "join class" in t:
-        return "Use the Join Class button available on your dashboard."
-
-    # 185. Change subject
-    if "change subject" in t:
-        return "Subject changes require approval from your coordinator."
-
-    # 186. Add subject
-    if "add subject" in t:
-        return "You can add subjects from the Course Enrollment section."
-
-    # 187. Remove subject
-    if "remove subject" in t:
-        return "Contact admin to remove the subject from your list."
-
-    # 188. Performance graph
-    if "graph" in t or "chart" in t:
-        return "Your performance graph is updated after every test."
-
-    # 189. Monthly report
-    if "monthly report" in t:
-        return "Monthly performance reports are generated automatically."
-
-    # 190. Study reminders
-    if "study reminder" in t:
-        return "Study reminders help you stay consistent. Enable them in Settings."
-
-    # 191. AI recommendations
-    if "ai recommend" in t:
-        return "AI recommendations are based on your performance, attendance, and activity."
-
-    # 192. Data update
-    if "update data" in t:
-        return "Your data is updated after each class, test, or activity by the system."
-
-    # 193. Server maintenance
-    if "maintenance" in t:
-        return "The server is under maintenance. Please try again later."
-
-    # 194. Logout help
-    if "how to logout" in t:
-        return "Click the Logout button in the top-right corner of the dashboard."
-
-    # 195. Improve coding
-    if "improve coding" in t:
-        return "Practice coding daily, solve small problems, and try building mini projects."
-
-    # 196. Study motivation
-    if "no motivation" in t:
-        return "It's normal to feel low. Take a break and restart with small tasks."
-
-    # 197. Weak network
-    if "weak network" in t:
-        return "Try switching networks or moving closer to your Wi-Fi router."
-
-    # 198. Exam preparation tips
-    if "exam tips" in t:
-        return "Revise notes, practice previous exams, and avoid last-minute cramming."
-
-    # 199. Course switching
-    if "switch course" in t:
-        return "Course switching is allowed within the first 7 days of enrollment."
+def api_login_required(f):
+    """Like login_required, but answers 401 JSON instead of redirecting."""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        if "user_id" not in session:
+            return jsonify(error="Please log in first."), 401
+        return f(*args, **kwargs)
+    return decorated
 
-    # 200. Unknown query fallback
-    if "help" in t or "question" in t:
-        return "I’m here to assist you. Please ask your question clearly."
+def admin_required(f):
+    """Only lets in users listed in ADMIN_USERS; answers JSON errors."""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        if "user_id" not in session:
+            return jsonify(error="Please log in first."), 401
+        if session.get("username") not in ADMIN_USERS:
+            return jsonify(error="Admins only."), 403
+        return f(*args, **kwargs)
+    return decorated
 
-    # default fallback
-    return "I’m still learning. Could you ask in a different way or be more specific?"
+def route_label():
+    """The matched URL rule, e.g. "/chatbot", so labels stay few."""
+    return request.url_rule.rule if request.url_rule is not None else "unmatched"
+
+# ---------- Metrics ----------
+# Served on /metrics in the Prometheus text format; see metrics.py.
+metrics = Registry()
+metrics.describe("http_request_duration_seconds", "histogram",
+                 "Time spent handling a request.")
+metrics.describe("http_request_phase_seconds", "histogram",
+                 "Time a request spent in one phase: db, hashing, matching or render.")
+metrics.describe("http_requests_total", "counter", "Requests handled.")
+metrics.describe("chatbot_answers_total", "counter",
+                 "Messages answered, by the intent that answered them.")
+
+@contextmanager
+def timed(phase):
+    """Add the time spent in the block to this request's total for phase."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        phases = g.get("phases") if has_request_context() else None
+        if phases is not None:
+            phases[phase] = phases.get(phase, 0.0) + time.perf_counter() - start
+
+@app.before_request
+def start_timer():
+    if METRICS_ENABLED:
+        g.request_start = time.perf_counter()
+        g.phases = {}
+
+@app.after_request
+def record_request(response):
+    start = g.pop("request_start", None)
+    if start is None:
+        return response
+    observe_request(route_label(), request.method, response.status_code,
+                    time.perf_counter() - start, g.phases)
+    return response
+
+def observe_request(route, method, status, seconds, phases):
+    """Record one handled request and the time it spent in each phase."""
+    labels = (("route", route), ("method", method))
+    metrics.observe("http_request_duration_seconds", labels, seconds)
+    metrics.inc("http_requests_total", labels + (("status", str(status)),))
+    for phase, spent in phases.items():
+        metrics.observe("http_request_phase_seconds", labels + (("phase", phase),), spent)
+
+@before_render_template.connect_via(app)
+def start_render_timer(sender, **extra):
+    g.render_start = time.perf_counter()
+
+@template_rendered.connect_via(app)
+def record_render(sender, **extra):
+    start = g.pop("render_start", None)
+    phases = g.get("phases")
+    if start is not None and phases is not None:
+        phases["render"] = phases.get("render", 0.0) + time.perf_counter() - start
+
+# ---------- Profiling ----------
+# Samples the stacks of chosen requests; see profiling.py.
+profiler = SamplingProfiler(PROFILE_DIR, PROFILE_RATE, root=Flask.wsgi_app.__code__)
+
+@app.before_request
+def start_profiler():
+    if profiler.should_sample():
+        profiler.start("%s %s" % (request.method, route_label()))
+        g.profiling = True
+
+@app.teardown_request
+def stop_profiler(exc):
+    if g.pop("profiling", False):
+        profiler.stop()
 
+# ---------- Simple AI-ish response function ----------
+reply_cache = ResponseCache(REPLY_CACHE_SIZE)
+# Rules from INTENTS_FILE, compiled once at startup and again, in the
+# background, whenever the file changes; see knowledge.py. knowledge.load()
+# swaps in rules given directly, and every swap clears the reply cache.
+knowledge = KnowledgeBase(INTENTS_FILE, MATCH_MODE, SEMANTIC_THRESHOLD, PRUNE_RULES,
+                          on_swap=reply_cache.clear, typo_distance=TYPO_MAX_DISTANCE,
+                          known_words=(load_wordlist(COMMON_WORDS) | load_wordlist(WORDLIST)
+                                       if TYPO_MAX_DISTANCE > 0 else ()))
+
+@app.before_request
+def watch_intents():
+    # started here rather than at import so that every worker process
+    # (including forked ones) runs its own watcher
+    if INTENTS_RELOAD_INTERVAL > 0:
+        knowledge.watch(INTENTS_RELOAD_INTERVAL)
+
+def answer(text):
+    """Return (intent, reply) for a message; intent is the name of the rule
+    that answered, or EMPTY_INTENT / FALLBACK_INTENT."""
+    result = _answer(normalize(text))
+    if METRICS_ENABLED:
+        metrics.inc("chatbot_answers_total", (("intent", result[0]),))
+    return result
+
+def _answer(t):
+    if not t:
+        return EMPTY_INTENT, EMPTY_REPLY
+
+    cached = reply_cache.get(t)
+    if cached is not None:
+        return cached
+
+    version = reply_cache.version
+    compiled = knowledge.current
+    rule = compiled.matcher.match(t)
+    if rule is None and compiled.spelling is not None:
+        # exact keywords take priority; only then try fixing typos
+        corrected = compiled.spelling.correct(t)
+        if corrected != t:
+            rule = compiled.matcher.match(corrected)
+    if rule is None and compiled.semantic is not None:
+        # no keyword matched: try the closest rule by meaning
+        rule = compiled.semantic.match(t)
+    if rule is not None:
+        result = (rule.name, rule.response)
+    else:
+        # default fallback
+        result = (FALLBACK_INTENT, FALLBACK_REPLY)
+    reply_cache.put(t, result, version)
+    return result
 
-    # default fallback
-    return "I’m still learning. Could you ask in a different way or be more specific?"
+def simple_ai_response(text: str) -> str:
+    return answer(text)[1]
+
+# Each student's recommended courses, read from the database once.
+recommendations = RecommendationCache()
+# Each student's attendance and marks totals (see records.py).
+student_data = SummaryCache(ttl=STUDENT_DATA_TTL, check_every=STUDENT_DATA_CHECK_INTERVAL)
+
+def personal_reply(user_id, intent, reply):
+    """Swap a canned reply for one drawn from the student's own data, where
+    there is such data."""
+    if intent in RECOMMEND_INTENTS:
+        with timed("db"):
+            courses, personal = recommendations.get(get_db(), user_id)
+        if courses:
+            listed = (courses[0] if len(courses) == 1
+                      else "%s and %s" % (", ".join(courses[:-1]), courses[-1]))
+            if personal:
+                return "Based on your courses and marks so far, I recommend %s." % listed
+            return ("Once you have some marks I can suggest courses for you; the most "
+                    "popular ones are %s." % listed)
+    kind = STUDENT_DATA_INTENTS.get(intent)
+    if kind is not None:
+        with timed("db"):
+            summary = student_data.get(get_db(), user_id)
+        return data_reply(kind, summary) or reply
+    return reply
+
+def _percent(value):
+    return "%g%%" % round(value, 1)
+
+def data_reply(kind, summary):
+    """Describe a student's Summary for one of STUDENT_DATA_INTENTS' kinds;
+    None when there is nothing to report yet."""
+    attendance = marks = trend = None
+    if summary.sessions:
+        attendance = "You have attended %d of %d sessions (%s)." % (
+            summary.present, summary.sessions, _percent(summary.attendance_percent))
+        minimum = min(t for _, t in ATTENDANCE_THRESHOLDS)
+        if summary.attendance_percent < minimum:
+            attendance += " That is below the %s needed to avoid academic alerts." % _percent(minimum)
+    if summary.assessments:
+        marks = "Your average over %d assessment%s is %s." % (
+            summary.assessments, "" if summary.assessments == 1 else "s",
+            _percent(summary.average_percent))
+        if summary.recent:
+            marks += " Latest: %s." % ", ".join(_percent(p) for p in summary.recent)
+    if len(summary.recent) >= 2:
+        # recent is newest first
+        change = summary.recent[0] - sum(summary.recent[1:]) / (len(summary.recent) - 1)
+        trend = ("Your latest mark is up on the ones before it." if change > 2 else
+                 "Your latest mark is down on the ones before it." if change < -2 else
+                 "Your marks have been steady.")
+
+    if kind == "attendance":
+        return attendance
+    if kind == "marks":
+        return marks
+    if kind == "performance":
+        parts = [p for p in (marks, trend, attendance) if p]
+        return " ".join(parts) if parts else None
+    if kind == "progress":
+        if not summary.sessions and not summary.assessments:
+            return None
+        progress = "So far you have %d assessment%s graded" % (
+            summary.assessments, "" if summary.assessments == 1 else "s")
+        if summary.last_assessed:
+            progress += ", the latest on %s" % summary.last_assessed
+        return progress + ", and %d session%s recorded." % (
+            summary.sessions, "" if summary.sessions == 1 else "s")
+    return None
+
+def check_messages(messages):
+    """Return why a batch of chat messages is refused, or None."""
+    if not isinstance(messages, list) or not all(isinstance(m, str) for m in messages):
+        return "message(s) must be strings."
+    if len(messages) > CHAT_API_MAX_BATCH:
+        return "At most %d messages per call." % CHAT_API_MAX_BATCH
+    return None
+
+def chat_replies(user_id, messages, answers):
+    """Finish answering messages for a student, given what answer() returned
+    for each: personalize the replies, log the messages and add them to the
+    chat history. Returns [{"reply": ..., "intent": ...}, ...]. Needs an app
+    context."""
+    replies = []
+    history = []
+    for message, (intent, reply) in zip(messages, answers):
+        reply = personal_reply(user_id, intent, reply)
+        replies.append({"reply": reply, "intent": intent})
+        if message.strip():
+            history += [("You", message.strip()), ("Bot", reply)]
+            chat_log.log(user_id, message.strip(), intent)
+    if history:
+        with timed("db"):
+            save_messages(get_db(), user_id, history)
+    return replies
 
 # ---------- Routes ----------
 @app.route("/")
@@ -879,14 +479,19 @@ def register():
 
         db = get_db()
         try:
-            hashed = generate_password_hash(password)
-            db.execute("INSERT INTO users (username, password) VALUES (?, ?)", (username, hashed))
-            db.commit()
+            with timed("hashing"):
+                hashed = hasher.hash(password)
+            with timed("db"):
+                db.execute("INSERT INTO users (username, password) VALUES (?, ?)", (username, hashed))
+                db.commit()
             flash("Registration successful. Please log in.", "success")
             return redirect(url_for("login"))
         except sqlite3.IntegrityError:
             flash("Username already taken. Choose another.", "danger")
             return render_template("register.html")
+        except Overloaded:
+            flash("The server is busy. Please try again in a moment.", "warning")
+            return render_template("register.html"), 503
 
     return render_template("register.html")
 
@@ -897,13 +502,25 @@ def login():
         password = request.form.get("password", "")
 
         db = get_db()
-        user = db.execute("SELECT * FROM users WHERE username = ?", (username,)).fetchone()
-        if user and check_password_hash(user["password"], password):
+        with timed("db"):
+            user = db.execute("SELECT * FROM users WHERE username = ?", (username,)).fetchone()
+        ok = False
+        if user:
+            try:
+                with timed("hashing"):
+                    ok, new_hash = hasher.verify(user["password"], password)
+            except Overloaded:
+                flash("The server is busy. Please try again in a moment.", "warning")
+                return render_template("login.html"), 503
+            if new_hash:
+                # stored with older hash settings: upgrade it transparently
+                with timed("db"):
+                    db.execute("UPDATE users SET password = ? WHERE id = ?", (new_hash, user["id"]))
+                    db.commit()
+        if ok:
             # store minimal data in session
             session["user_id"] = user["id"]
             session["username"] = user["username"]
-            # reset chat history on login
-            session["history"] = []
             flash("Logged in successfully.", "success")
             return redirect(url_for("chatbot"))
         else:
@@ -915,25 +532,173 @@ def login():
 @app.route("/chatbot", methods=["GET", "POST"])
 @login_required
 def chatbot():
-    history = session.get("history", [])
-    bot_reply = None
+    db = get_db()
+    user_id = session["user_id"]
 
     if request.method == "POST":
         user_message = request.form.get("message", "").strip()
         if user_message:
-            # append user message
-            history.append(("You", user_message))
-            bot_reply = simple_ai_response(user_message)
-            history.append(("Bot", bot_reply))
-            # save back to session
-            session["history"] = history
-            session.modified = True
-
-    return render_template("chatbot.html", history=history, username=session.get("username"))
+            with timed("matching"):
+                intent, bot_reply = answer(user_message)
+            bot_reply = personal_reply(user_id, intent, bot_reply)
+            chat_log.log(user_id, user_message, intent)
+            with timed("db"):
+                save_messages(db, user_id, [("You", user_message), ("Bot", bot_reply)])
+
+    before = request.args.get("before", type=int)
+    with timed("db"):
+        history, older = recent_messages(db, user_id, before)
+    return render_template("chatbot.html", history=history, older=older,
+                           username=session.get("username"))
+
+@app.route("/api/chat", methods=["POST"])
+@api_login_required
+def api_chat():
+    """Answer chat messages without rendering the page.
+
+    Takes {"message": "..."} and returns {"reply": ..., "intent": ...}, or
+    takes {"messages": [...]} and returns {"replies": [{"reply": ...,
+    "intent": ...}, ...]} in the same order. Form fields named message /
+    messages work too.
+    Answered messages are added to the user's chat history.
+    """
+    data = request.get_json(silent=True)
+    if data is None:
+        batch = "messages" in request.form
+        messages = (request.form.getlist("messages") if batch
+                    else [request.form.get("message", "")])
+    elif isinstance(data, dict):
+        batch = "messages" in data
+        messages = data["messages"] if batch else [data.get("message", "")]
+    else:
+        messages = None
+    error = check_messages(messages)
+    if error:
+        return jsonify(error=error), 400
+
+    answers = []
+    for message in messages:
+        with timed("matching"):
+            answers.append(answer(message))
+    replies = chat_replies(session["user_id"], messages, answers)
+    if batch:
+        return jsonify(replies=replies)
+    return jsonify(replies[0])
+
+@app.route("/metrics")
+def metrics_endpoint():
+    """Prometheus scrape endpoint."""
+    if not METRICS_ENABLED:
+        return "Not Found", 404
+    answers = metrics.counter_totals("chatbot_answers_total")
+    answered = sum(n for labels, n in answers.items() if labels != (("intent", EMPTY_INTENT),))
+    fallbacks = answers.get((("intent", FALLBACK_INTENT),), 0)
+    cache = reply_cache.stats()
+    data_cache = student_data.stats()
+    extra = [
+        ("chatbot_fallback_ratio", "gauge",
+         "Share of non-empty messages no rule answered, since start.",
+         [((), fallbacks / answered if answered else 0.0)]),
+        ("chatbot_reply_cache_hits_total", "counter", "Reply cache hits.",
+         [((), cache["hits"])]),
+        ("chatbot_reply_cache_misses_total", "counter", "Reply cache misses.",
+         [((), cache["misses"])]),
+        ("chatbot_reply_cache_evictions_total", "counter", "Reply cache evictions.",
+         [((), cache["evictions"])]),
+        ("student_data_cache_hits_total", "counter", "Student data cache hits.",
+         [((), data_cache["hits"])]),
+        ("student_data_cache_misses_total", "counter", "Student data cache misses.",
+         [((), data_cache["misses"])]),
+        ("chatbot_rules", "gauge", "Rules loaded from the intents file.",
+         [((), len(knowledge.current.rules))]),
+        ("chatbot_intent_reloads_total", "counter", "Reloads of the intents file.",
+         [((), knowledge.reloads)]),
+        ("chat_log_written_total", "counter", "Chat log records written.",
+         [((), chat_log.written)]),
+        ("chat_log_dropped_total", "counter", "Chat log records dropped on a full queue.",
+         [((), chat_log.dropped)]),
+        ("chat_log_failed_total", "counter", "Chat log records lost to database errors.",
+         [((), chat_log.failed)]),
+        ("chat_log_queued", "gauge", "Chat log records waiting to be written.",
+         [((), chat_log.pending())]),
+        ("password_hash_rejected_total", "counter",
+         "Hash requests rejected because too many were pending.",
+         [((), hasher.rejected)]),
+    ]
+    return Response(metrics.render(extra), mimetype="text/plain; version=0.0.4")
+
+@app.route("/admin/profiler", methods=["GET", "POST"])
+@admin_required
+def admin_profiler():
+    """Show the profiler's state, or change it.
+
+    POST {"rate": 0.05} profiles 5% of requests from now on, {"seconds": 60}
+    profiles every request for the next minute, and {"rate": 0, "seconds": 0}
+    turns profiling off. Form fields work too.
+    """
+    if request.method == "POST":
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            data = request.form
+        try:
+            rate = data.get("rate")
+            seconds = data.get("seconds")
+            profiler.configure(None if rate in (None, "") else float(rate),
+                               None if seconds in (None, "") else float(seconds))
+        except (TypeError, ValueError) as e:
+            return jsonify(error=str(e)), 400
+    return jsonify(profiler.status())
+
+@app.route("/admin/search")
+@admin_required
+def admin_search():
+    """Search every user's chat messages.
+
+    ?q= takes words and "quoted phrases", all of which must occur; add
+    &sender=You to only see students' own messages and &page=N for more.
+    Results come best match first, each with a snippet that is HTML-escaped
+    and has the matched words wrapped in <mark>.
+    """
+    q = request.args.get("q", "").strip()
+    page = request.args.get("page", 1, type=int)
+    sender = request.args.get("sender") or None
+    if not q:
+        return jsonify(error="Give a search query in q."), 400
+    if page < 1:
+        return jsonify(error="page must be 1 or more."), 400
+    db = get_db()
+    with timed("db"):
+        hits, more = search(db, q, page, SEARCH_PAGE_SIZE, sender)
+        pending = backlog(db)
+    return jsonify(
+        query=q,
+        page=page,
+        next_page=page + 1 if more else None,
+        results=[hit._asdict() for hit in hits],
+        # older messages not searchable yet; run "python search.py rebuild"
+        unindexed=pending[1] - pending[0] if pending else 0,
+    )
+
+@app.route("/api/summary")
+@api_login_required
+def api_summary():
+    """The logged-in student's attendance and marks totals, read from the
+    summary tables (see records.py) at most every STUDENT_DATA_TTL seconds."""
+    with timed("db"):
+        summary = student_data.get(get_db(), session["user_id"])
+    return jsonify(summary._asdict())
+
+@app.route("/api/alerts")
+@api_login_required
+def api_alerts():
+    """The logged-in student's open attendance alerts (see alerts.py)."""
+    with timed("db"):
+        alerts = open_alerts(get_db(), session["user_id"])
+    return jsonify(alerts=[a._asdict() for a in alerts])
 
 @app.route("/logout")
 def logout():
-    session_keys = ["user_id", "username", "history"]
+    session_keys = ["user_id", "username"]
     for k in session_keys:
         session.pop(k, None)
     flash("You have been logged out.", "info")
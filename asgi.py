@@ -0,0 +1,425 @@
+"""Async serving mode.
+
+    pip install uvicorn
+    uvicorn asgi:application --host 0.0.0.0 --port 8000
+
+`application` is an ASGI app. POST /api/chat is served by a coroutine on
+the event loop, so an open chat connection waiting for its next message
+costs a socket and a few objects instead of a worker thread. The work
+itself is kept off the loop:
+
+- matching runs on a small CPU thread pool (ASGI_CPU_THREADS);
+- SQLite runs on a dedicated thread pool (ASGI_DB_THREADS), using the
+  app's pooled connections (see db.py);
+- password hashing already runs in its own process pool (see hashing.py).
+
+The chat page talks to the WebSocket at /ws/chat when it can: the login
+session is checked once when the socket opens, and each message is then
+one frame in and one reply frame out (see ChatConnection).
+
+Every other URL (pages, login, admin, /metrics) is handed to the Flask app
+on another thread pool (ASGI_WSGI_THREADS), so the site works unchanged.
+The login session is the same signed cookie Flask uses.
+"""
+import asyncio
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from itsdangerous import BadSignature
+from werkzeug.http import parse_cookie
+
+import app
+
+# Threads doing SQLite work for the async endpoints.
+DB_THREADS = int(os.environ.get("ASGI_DB_THREADS", "4"))
+# Threads matching messages against the rules.
+CPU_THREADS = int(os.environ.get("ASGI_CPU_THREADS", "2"))
+# Threads running Flask for everything else.
+WSGI_THREADS = int(os.environ.get("ASGI_WSGI_THREADS", "16"))
+# Largest request body or WebSocket frame accepted, in bytes.
+MAX_BODY = int(os.environ.get("ASGI_MAX_BODY", str(1024 * 1024)))
+# Seconds between pings on open chat sockets; a socket silent for two of
+# these is taken for dead and closed.
+WS_HEARTBEAT = float(os.environ.get("ASGI_WS_HEARTBEAT", "30"))
+# Seconds a chat socket may stay open without a chat message.
+WS_IDLE_TIMEOUT = float(os.environ.get("ASGI_WS_IDLE_TIMEOUT", "900"))
+# Most chat sockets open at once in this process.
+WS_MAX_CONNECTIONS = int(os.environ.get("ASGI_WS_MAX_CONNECTIONS", "10000"))
+# Chat lines sent to a chat socket when it opens.
+WS_RECENT = int(os.environ.get("ASGI_WS_RECENT", "20"))
+# Comma-separated origins (like "https://chat.example.edu") whose pages may
+# open chat sockets besides the site's own; see origin_allowed.
+WS_ALLOWED_ORIGINS = frozenset(
+    o.strip().rstrip("/").lower() for o in os.environ.get("ASGI_WS_ALLOWED_ORIGINS", "").split(",")
+    if o.strip())
+
+db_pool = ThreadPoolExecutor(DB_THREADS, thread_name_prefix="asgi-db")
+cpu_pool = ThreadPoolExecutor(CPU_THREADS, thread_name_prefix="asgi-cpu")
+wsgi_pool = ThreadPoolExecutor(WSGI_THREADS, thread_name_prefix="asgi-wsgi")
+
+
+class BodyTooLarge(Exception):
+    pass
+
+
+def _header(scope, name):
+    """All values of a request header joined, as text."""
+    return "; ".join(v.decode("latin-1") for k, v in scope["headers"] if k == name)
+
+
+def session_user(scope):
+    """The user id in the request's Flask session cookie, or None."""
+    flask_app = app.app
+    cookie = parse_cookie(_header(scope, b"cookie")).get(flask_app.config["SESSION_COOKIE_NAME"])
+    serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+    if not cookie or serializer is None:
+        return None
+    max_age = int(flask_app.permanent_session_lifetime.total_seconds())
+    try:
+        return serializer.loads(cookie, max_age=max_age).get("user_id")
+    except BadSignature:
+        return None
+
+
+def origin_allowed(scope):
+    """Whether a WebSocket handshake may use the session cookie.
+
+    Browsers send the cookie whichever site opened the socket, so a page
+    elsewhere could chat as the student. Its Origin must be this site (the
+    Host the handshake was sent to) or in WS_ALLOWED_ORIGINS. Clients that
+    send no Origin are not browsers and are let through.
+    """
+    origin = _header(scope, b"origin").strip().rstrip("/").lower()
+    if not origin or origin in WS_ALLOWED_ORIGINS:
+        return True
+    host = _header(scope, b"host").strip().lower()
+    return bool(host) and urlsplit(origin).netloc == host
+
+
+async def read_body(receive):
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > MAX_BODY:
+            raise BodyTooLarge()
+        chunks.append(chunk)
+        if not message.get("more_body"):
+            break
+    return b"".join(chunks)
+
+
+async def send_response(send, status, body, headers=()):
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(k.encode("latin-1"), v.encode("latin-1")) for k, v in headers]})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def send_json(send, status, data):
+    body = json.dumps(data).encode("utf-8")
+    await send_response(send, status, body, [("content-type", "application/json"),
+                                             ("content-length", str(len(body)))])
+
+
+# ---------- Async chat ----------
+def _answer_all(messages):
+    return [app.answer(m) for m in messages]
+
+
+def _finish(user_id, messages, answers):
+    with app.app.app_context():
+        return app.chat_replies(user_id, messages, answers)
+
+
+async def run(pool, fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(pool, fn, *args)
+
+
+async def api_chat(scope, receive, send):
+    """POST /api/chat, as in app.py but JSON only."""
+    if scope["method"] != "POST":
+        return await send_json(send, 405, {"error": "Use POST."})
+    user_id = session_user(scope)
+    if user_id is None:
+        return await send_json(send, 401, {"error": "Please log in first."})
+    try:
+        data = json.loads(await read_body(receive) or b"null")
+    except BodyTooLarge:
+        return await send_json(send, 413, {"error": "Request too large."})
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        return await send_json(send, 400, {"error": "Send a JSON object."})
+    batch = "messages" in data
+    messages = data["messages"] if batch else [data.get("message", "")]
+    error = app.check_messages(messages)
+    if error:
+        return await send_json(send, 400, {"error": error})
+
+    phases = {}
+    start = time.perf_counter()
+    answers = await run(cpu_pool, _answer_all, messages)
+    phases["matching"] = time.perf_counter() - start
+    replies = await run(db_pool, _finish, user_id, messages, answers)
+    phases["db"] = time.perf_counter() - start - phases["matching"]
+    await send_json(send, 200, {"replies": replies} if batch else replies[0])
+    if app.METRICS_ENABLED:
+        app.observe_request("/api/chat", "POST", 200, time.perf_counter() - start, phases)
+
+
+# ---------- Chat sockets ----------
+# Close codes; 4000-4999 are free for applications.
+CLOSE_GOING_AWAY = 1001
+CLOSE_TRY_AGAIN = 1013
+CLOSE_IDLE = 4000
+CLOSE_UNAUTHORIZED = 4401
+CLOSE_FORBIDDEN = 4403
+
+app.metrics.describe("chat_sockets_opened_total", "counter", "Chat sockets accepted.")
+app.metrics.describe("chat_sockets_closed_total", "counter",
+                     "Chat sockets closed, by reason: client, idle, dead or full.")
+
+
+class ChatConnection:
+    """Server-side state of one chat socket: who it belongs to and when
+    the client was last heard from."""
+
+    __slots__ = ("user_id", "last_seen", "last_message", "closed", "_send", "_lock")
+
+    def __init__(self, user_id, send):
+        self.user_id = user_id
+        self.last_seen = self.last_message = time.monotonic()
+        self.closed = False
+        self._send = send
+        self._lock = asyncio.Lock()
+
+    async def push(self, data):
+        async with self._lock:
+            if not self.closed:
+                await self._send({"type": "websocket.send", "text": json.dumps(data)})
+
+    async def close(self, code, reason):
+        async with self._lock:
+            if not self.closed:
+                self.closed = True
+                app.metrics.inc("chat_sockets_closed_total", (("reason", reason),))
+                await self._send({"type": "websocket.close", "code": code})
+
+
+class ChatSockets:
+    """The open chat sockets of this process.
+
+    A single task pings all of them every `heartbeat` seconds and closes
+    those whose client went quiet for two heartbeats or has not chatted
+    for `idle_timeout`, so dropped and forgotten tabs do not pile up. The
+    task stops when no socket is left and restarts with the next one.
+    """
+
+    def __init__(self, heartbeat=WS_HEARTBEAT, idle_timeout=WS_IDLE_TIMEOUT,
+                 maxsize=WS_MAX_CONNECTIONS):
+        self.heartbeat = heartbeat
+        self.idle_timeout = idle_timeout
+        self.maxsize = maxsize
+        self.open = set()
+        self._sweeper = None
+
+    def full(self):
+        return len(self.open) >= self.maxsize
+
+    def add(self, conn):
+        self.open.add(conn)
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.get_running_loop().create_task(self._sweep())
+
+    def discard(self, conn):
+        self.open.discard(conn)
+
+    async def _sweep(self):
+        while self.open:
+            await asyncio.sleep(self.heartbeat)
+            now = time.monotonic()
+            calls = []
+            for conn in list(self.open):
+                if now - conn.last_seen > 2 * self.heartbeat:
+                    calls.append(conn.close(CLOSE_GOING_AWAY, "dead"))
+                elif now - conn.last_message > self.idle_timeout:
+                    calls.append(conn.close(CLOSE_IDLE, "idle"))
+                else:
+                    calls.append(conn.push({"type": "ping"}))
+            # a send failing means the socket is gone; its handler cleans up
+            await asyncio.gather(*calls, return_exceptions=True)
+
+
+sockets = ChatSockets()
+
+
+def _history(user_id):
+    with app.app.app_context():
+        return app.recent_messages(app.get_db(), user_id, limit=WS_RECENT)[0]
+
+
+def _frame_message(message):
+    """The chat message in a received frame, or None for a heartbeat reply.
+    Frames are {"message": "..."}, {"type": "pong"} or plain text."""
+    text = message.get("text")
+    if text is None:
+        text = (message.get("bytes") or b"").decode("utf-8", "replace")
+    if text.startswith("{"):
+        try:
+            data = json.loads(text)
+        except ValueError:
+            return text
+        if isinstance(data, dict):
+            if data.get("type") == "pong":
+                return None
+            text = data.get("message")
+            return text if isinstance(text, str) else ""
+    return text
+
+
+async def chat_socket(scope, receive, send):
+    """WebSocket /ws/chat: {"message": ...} in, {"type": "reply", "reply":
+    ..., "intent": ...} out. The first frame sent is {"type": "history",
+    "messages": [[sender, message], ...]}; {"type": "ping"} frames should be
+    answered with {"type": "pong"}."""
+    if (await receive())["type"] != "websocket.connect":
+        return
+    if not origin_allowed(scope):
+        return await send({"type": "websocket.close", "code": CLOSE_FORBIDDEN})
+    user_id = session_user(scope)
+    if user_id is None:
+        return await send({"type": "websocket.close", "code": CLOSE_UNAUTHORIZED})
+    if sockets.full():
+        app.metrics.inc("chat_sockets_closed_total", (("reason", "full"),))
+        return await send({"type": "websocket.close", "code": CLOSE_TRY_AGAIN})
+    # take the slot before the first await so handshakes arriving meanwhile
+    # see it
+    conn = ChatConnection(user_id, send)
+    sockets.add(conn)
+    try:
+        await send({"type": "websocket.accept"})
+        app.metrics.inc("chat_sockets_opened_total")
+        await conn.push({"type": "history", "messages": await run(db_pool, _history, user_id)})
+        while True:
+            message = await receive()
+            if message["type"] == "websocket.disconnect":
+                if not conn.closed:
+                    conn.closed = True
+                    app.metrics.inc("chat_sockets_closed_total", (("reason", "client"),))
+                return
+            conn.last_seen = time.monotonic()
+            text = _frame_message(message)
+            if text is None:
+                continue
+            if len(text) > MAX_BODY:
+                await conn.push({"type": "error", "error": "Message too long."})
+                continue
+            conn.last_message = conn.last_seen
+            answers = await run(cpu_pool, _answer_all, [text])
+            reply = (await run(db_pool, _finish, user_id, [text], answers))[0]
+            await conn.push(dict(reply, type="reply"))
+    finally:
+        sockets.discard(conn)
+
+
+# ---------- Everything else: Flask ----------
+def _environ(scope, body):
+    server = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope["query_string"].decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": "HTTP/%s" % scope.get("http_version", "1.1"),
+        "REMOTE_ADDR": scope["client"][0] if scope.get("client") else "",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        # the whole body is already read, whatever Content-Length says
+        "wsgi.input_terminated": True,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope["headers"]:
+        name = name.decode("latin-1").upper().replace("-", "_")
+        key = name if name in ("CONTENT_TYPE", "CONTENT_LENGTH") else "HTTP_" + name
+        value = value.decode("latin-1")
+        if key in environ:
+            value = environ[key] + ("; " if key == "HTTP_COOKIE" else ",") + value
+        environ[key] = value
+    return environ
+
+
+def _call_flask(environ):
+    """Run the Flask app on a request; returns (status, headers, body)."""
+    started = []
+    chunks = []
+
+    def start_response(status, headers, exc_info=None):
+        started[:] = [int(status.split(" ", 1)[0]), headers]
+        return chunks.append
+
+    result = app.app(environ, start_response)
+    try:
+        chunks.extend(result)
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+    return started[0], started[1], b"".join(chunks)
+
+
+async def serve_flask(scope, receive, send):
+    try:
+        body = await read_body(receive)
+    except BodyTooLarge:
+        return await send_response(send, 413, b"Request too large.")
+    status, headers, body = await run(wsgi_pool, _call_flask, _environ(scope, body))
+    await send_response(send, status, body, headers)
+
+
+# ---------- ASGI entry point ----------
+ROUTES = {
+    "/api/chat": api_chat,
+}
+SOCKET_ROUTES = {
+    "/ws/chat": chat_socket,
+}
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await run(db_pool, app.init_db)
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await run(db_pool, app.chat_log.close)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    if scope["type"] == "websocket":
+        handler = SOCKET_ROUTES.get(scope["path"])
+        if handler is None:
+            return await send({"type": "websocket.close", "code": 1000})
+        return await handler(scope, receive, send)
+    if scope["type"] != "http":
+        raise ValueError("unsupported connection type %r" % scope["type"])
+    handler = ROUTES.get(scope["path"], serve_flask)
+    await handler(scope, receive, send)
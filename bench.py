@@ -0,0 +1,253 @@
+"""Benchmarks for the chatbot reply path.
+
+Runs a fixed query corpus through the intent matcher, the semantic fallback,
+simple_ai_response (with its reply cache), and the /chatbot and /api/chat
+routes via the Flask test client, then prints a JSON report:
+
+    python bench.py                        # report to stdout
+    python bench.py -o bench_output.txt    # report to a file
+    python bench.py --compare old.json     # exit 1 if any p50 got slower
+
+Times are in microseconds. The corpus is fixed so reports from different
+versions can be compared directly.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+import app
+
+# ---------- Query corpus ----------
+EARLY_HITS = [
+    "hello",
+    "hi there",
+    "what courses do you offer",
+    "i need project help",
+    "how do i register",
+    "thanks a lot",
+    "what is my attendance",
+    "show my performance",
+]
+
+LATE_HITS = [
+    "is there a quiz tomorrow",
+    "where is the syllabus",
+    "what is the file size limit",
+    "can i get extra credit",
+    "any new announcement",
+    "what is the deadline",
+    "tell me about the unit test",
+    "is the server down",
+    "how do i recheck my paper",
+    "is there a monthly report",
+    "i need a partner",
+    "where is the graph",
+    "can i use a tablet device",
+    "what language is used",
+]
+
+FALLBACKS = [
+    "what is the weather on mars",
+    "can you sing a song",
+    "who won the match yesterday",
+    "tell me a joke",
+    "what would you say to a zebra",
+    "good morning",
+    "where do penguins go",
+    "i want to switch to another track",
+]
+
+# A few hundred words of text that matches no rule, alone and followed by a
+# late-rule keyword.
+_FILLER = " ".join(FALLBACKS * 8)
+LONG_MESSAGES = [
+    _FILLER,
+    _FILLER + " where is the syllabus",
+    _FILLER + " is there a monthly report",
+]
+
+CORPUS = {
+    "early_hit": EARLY_HITS,
+    "late_hit": LATE_HITS,
+    "fallback": FALLBACKS,
+    "long": LONG_MESSAGES,
+}
+
+
+# ---------- Measurement ----------
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+def summarize(samples, elapsed):
+    """Turn per-call timings (seconds) into a report entry (microseconds)."""
+    us = sorted(s * 1e6 for s in samples)
+    return {
+        "count": len(us),
+        "mean_us": round(statistics.fmean(us), 3),
+        "p50_us": round(percentile(us, 50), 3),
+        "p90_us": round(percentile(us, 90), 3),
+        "p99_us": round(percentile(us, 99), 3),
+        "max_us": round(us[-1], 3),
+        "throughput_per_s": round(len(us) / elapsed, 1) if elapsed else 0.0,
+    }
+
+
+def time_calls(fn, queries, repeat):
+    samples = []
+    clock = time.perf_counter
+    start = clock()
+    for _ in range(repeat):
+        for q in queries:
+            t0 = clock()
+            fn(q)
+            samples.append(clock() - t0)
+    return summarize(samples, clock() - start)
+
+
+def bench_matcher(repeat):
+    """The compiled matcher alone: no normalization, no cache."""
+    match = app.knowledge.current.matcher.match
+    return {name: time_calls(lambda q: match(app.normalize(q)), queries, repeat)
+            for name, queries in CORPUS.items()}
+
+
+def bench_semantic(repeat):
+    """The TF-IDF fallback stage on messages no keyword rule matches."""
+    match = app.knowledge.current.semantic.match
+    return {name: time_calls(lambda q: match(app.normalize(q)), CORPUS[name], repeat)
+            for name in ("fallback", "long")}
+
+
+def bench_reply(repeat):
+    """simple_ai_response with a warm reply cache (the steady state)."""
+    results = {}
+    for name, queries in CORPUS.items():
+        app.reply_cache.clear()
+        for q in queries:
+            app.simple_ai_response(q)
+        results[name] = time_calls(app.simple_ai_response, queries, repeat)
+    return results
+
+
+def post_chatbot(client, message):
+    return client.post("/chatbot", data={"message": message})
+
+
+def post_api(client, message):
+    return client.post("/api/chat", json={"message": message})
+
+
+def bench_route(repeat, send):
+    """Whole requests made with send(client, message): session decode,
+    reply, history insert (and page query and render for /chatbot),
+    session encode. Runs against a throwaway database."""
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    old_database = app.DATABASE
+    app.DATABASE = path
+    try:
+        app.init_db()
+        client = app.app.test_client()
+        with client.session_transaction() as sess:
+            sess["user_id"] = 1
+            sess["username"] = "bench"
+        results = {}
+        for name, queries in CORPUS.items():
+            samples = []
+            clock = time.perf_counter
+            start = clock()
+            for _ in range(repeat):
+                for q in queries:
+                    t0 = clock()
+                    resp = send(client, q)
+                    samples.append(clock() - t0)
+                    if resp.status_code != 200:
+                        raise RuntimeError("%s returned %d" % (resp.request.path, resp.status_code))
+            results[name] = summarize(samples, clock() - start)
+        return results
+    finally:
+        app.chat_log.flush()
+        app.DATABASE = old_database
+        os.remove(path)
+
+
+def run(repeat, route_repeat):
+    results = {"matcher": bench_matcher(repeat)}
+    if app.knowledge.current.semantic is not None:
+        results["semantic"] = bench_semantic(repeat)
+    results["simple_ai_response"] = bench_reply(repeat)
+    results["chatbot_route"] = bench_route(route_repeat, post_chatbot)
+    results["api_chat"] = bench_route(route_repeat, post_api)
+    return {
+        "python": platform.python_version(),
+        "match_mode": app.MATCH_MODE,
+        "rules": len(app.knowledge.current.rules),
+        "compiled_rules": len(app.knowledge.current.matcher.rules),
+        "results": results,
+    }
+
+
+def compare(report, baseline, threshold, min_delta):
+    """Return (section, category, old p50, new p50) for every regression.
+
+    A p50 counts as a regression when it is more than `threshold` times the
+    old one and at least `min_delta` microseconds slower, so timer jitter
+    on sub-microsecond paths is not reported.
+    """
+    regressions = []
+    for section, categories in report["results"].items():
+        for name, entry in categories.items():
+            old = baseline.get("results", {}).get(section, {}).get(name)
+            if not old:
+                continue
+            new_p50, old_p50 = entry["p50_us"], old["p50_us"]
+            if new_p50 > old_p50 * threshold and new_p50 - old_p50 >= min_delta:
+                regressions.append((section, name, old_p50, new_p50))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=200,
+                        help="passes over the corpus for the in-process benchmarks")
+    parser.add_argument("--route-repeat", type=int, default=10,
+                        help="passes over the corpus for the /chatbot benchmark")
+    parser.add_argument("-o", "--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--compare", metavar="REPORT",
+                        help="earlier JSON report to check this run against")
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="p50 slowdown ratio that counts as a regression")
+    parser.add_argument("--min-delta", type=float, default=2.0,
+                        help="smallest p50 slowdown, in microseconds, that counts")
+    args = parser.parse_args(argv)
+
+    report = run(args.repeat, args.route_repeat)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.threshold, args.min_delta)
+        for section, name, old, new in regressions:
+            print("regression: %s/%s p50 %.1fus -> %.1fus" % (section, name, old, new),
+                  file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+"""Log of every chatbot exchange, for growing the knowledge base.
+
+    python chatlog.py                # most common unanswered questions
+    python chatlog.py --top 50 --days 7
+
+Requests never write the log themselves. ChatLogWriter.log() puts a record
+on a bounded in-memory queue and returns at once. A background thread
+takes records off in batches and writes each batch with a single
+executemany and commit, so disk speed never shows up in request latency.
+When the queue is full (the disk can't keep up) records are dropped and
+counted rather than letting requests wait; a short wait can be allowed
+with block_timeout.
+"""
+import argparse
+import atexit
+import logging
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+
+from db import connect
+
+log = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+def timestamp(now=None):
+    """UTC time in the format of the tables' created_at columns."""
+    now = time.time() if now is None else now
+    return "%s.%03d" % (time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(now)),
+                        int(now % 1 * 1000))
+
+
+class ChatLogWriter:
+    def __init__(self, path, maxsize=10000, batch_size=500, flush_interval=1.0,
+                 block_timeout=0.0):
+        # a path, or a callable returning one (read at every write)
+        self.path = path
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.block_timeout = block_timeout
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.commits = 0
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._registered = False
+
+    def log(self, user_id, message, intent):
+        """Queue one exchange; never waits longer than block_timeout."""
+        if self._pid != os.getpid():
+            self._start()
+        record = (user_id, message, intent, timestamp())
+        try:
+            if self.block_timeout > 0:
+                self._queue.put(record, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def pending(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def flush(self):
+        """Wait until everything queued so far is written."""
+        if self._pid == os.getpid():
+            self._queue.join()
+
+    def close(self):
+        """Write what is queued and stop the writer thread."""
+        if self._pid == os.getpid() and self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+
+    def _start(self):
+        # per process: a forked worker gets its own queue and thread
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(self.maxsize)
+            self._thread = threading.Thread(target=self._run, args=(self._queue,),
+                                            name="chat-log-writer", daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+            if not self._registered:
+                atexit.register(self.close)
+                self._registered = True
+
+    def _run(self, q):
+        conn = None
+        conn_path = None
+        while True:
+            batch = [q.get()]
+            # gather a batch: up to batch_size records or flush_interval
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size and batch[-1] is not _STOP:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(q.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            records = [r for r in batch if r is not _STOP]
+            if records:
+                path = self.path() if callable(self.path) else self.path
+                try:
+                    if path != conn_path:
+                        if conn is not None:
+                            conn.close()
+                        conn = connect(path)
+                        conn_path = path
+                    with conn:
+                        conn.executemany(
+                            "INSERT INTO chat_log (user_id, message, intent, created_at)"
+                            " VALUES (?, ?, ?, ?)", records)
+                    self.written += len(records)
+                    self.commits += 1
+                except sqlite3.Error as e:
+                    self.failed += len(records)
+                    log.error("could not write %d chat log records: %s", len(records), e)
+            for _ in batch:
+                q.task_done()
+            if batch[-1] is _STOP:
+                if conn is not None:
+                    conn.close()
+                return
+
+
+def unanswered(db, top=20, days=None):
+    """Return (message, times asked) for the most common fallback messages."""
+    sql = ("SELECT lower(trim(message)) AS m, count(*) AS n FROM chat_log"
+           " WHERE intent = 'fallback'")
+    params = []
+    if days is not None:
+        sql += " AND created_at >= ?"
+        params.append(timestamp(time.time() - days * 86400))
+    sql += " GROUP BY m ORDER BY n DESC, m LIMIT ?"
+    params.append(top)
+    return [(r["m"], r["n"]) for r in db.execute(sql, params)]
+
+
+def main(argv=None):
+    import app
+
+    parser = argparse.ArgumentParser(description="List the questions the chatbot could not answer.")
+    parser.add_argument("--db", default=app.DATABASE, help="database file (default: %(default)s)")
+    parser.add_argument("--top", type=int, default=20, help="questions to show")
+    parser.add_argument("--days", type=float, help="only look at the last DAYS days")
+    args = parser.parse_args(argv)
+
+    app.DATABASE = args.db
+    app.init_db()
+    db = connect(args.db)
+    total = db.execute("SELECT count(*) FROM chat_log").fetchone()[0]
+    fallbacks = db.execute("SELECT count(*) FROM chat_log WHERE intent = 'fallback'").fetchone()[0]
+    for message, n in unanswered(db, args.top, args.days):
+        print("%6d  %s" % (n, message))
+    print("%d of %d logged messages fell back (%.1f%%)"
+          % (fallbacks, total, 100.0 * fallbacks / total if total else 0.0))
+    db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
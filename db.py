@@ -0,0 +1,119 @@
+"""SQLite connection management.
+
+Requests borrow a connection from a small pool shared by all threads and
+hand it back afterwards, instead of opening and closing one per request.
+This matters under `python app.py`, where Werkzeug starts a new thread for
+every request, so nothing kept per thread would ever be reused.
+Connections run in WAL mode, so readers are not blocked by a writer, and
+wait up to busy_timeout for a lock instead of failing. sqlite3 caches each
+connection's prepared statements by SQL text, so the hot queries are
+compiled once per pooled connection rather than once per request.
+"""
+import os
+import sqlite3
+import threading
+from itertools import islice
+
+# Tunables (see https://www.sqlite.org/pragma.html).
+# synchronous=NORMAL is durable across application crashes in WAL mode and
+# only risks the last transactions on power loss.
+SYNCHRONOUS = os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL").upper()
+# Negative values are KiB, positive values are pages.
+CACHE_SIZE = int(os.environ.get("SQLITE_CACHE_SIZE", "-16000"))
+BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+# Prepared statements kept per connection.
+CACHED_STATEMENTS = int(os.environ.get("SQLITE_CACHED_STATEMENTS", "128"))
+# Idle connections kept open per database file for the next request.
+POOL_SIZE = int(os.environ.get("SQLITE_POOL_SIZE", "8"))
+
+SYNCHRONOUS_MODES = ("OFF", "NORMAL", "FULL", "EXTRA")
+# Most values bound in one IN (...) list; SQLite allows at least 999 bound
+# parameters per statement.
+MAX_PARAMS = 900
+
+
+def connect(path, check_same_thread=True):
+    """Open a connection to path with WAL and the tuned pragmas applied."""
+    if SYNCHRONOUS not in SYNCHRONOUS_MODES:
+        raise ValueError("SQLITE_SYNCHRONOUS must be one of %s" % ", ".join(SYNCHRONOUS_MODES))
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000,
+                           cached_statements=CACHED_STATEMENTS,
+                           check_same_thread=check_same_thread)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA busy_timeout = %d" % BUSY_TIMEOUT_MS)
+    conn.execute("PRAGMA synchronous = %s" % SYNCHRONOUS)
+    conn.execute("PRAGMA cache_size = %d" % CACHE_SIZE)
+    return conn
+
+
+def batches(iterable, size):
+    """Lists of up to size items from iterable, e.g. rows per transaction."""
+    it = iter(iterable)
+    while True:
+        batch = list(islice(it, size))
+        if not batch:
+            return
+        yield batch
+
+
+class ConnectionManager:
+    """A pool of open connections per database path, shared by all threads.
+
+    get() hands out an idle connection, or opens one when none is idle;
+    release() returns it. At most `size` idle connections are kept per path
+    and any beyond that are closed, so a burst of concurrent requests does
+    not leave connections open for good. A connection is only ever used by
+    the thread that borrowed it until it is released. A forked worker
+    process opens its own rather than reusing its parent's.
+    """
+
+    def __init__(self, size=POOL_SIZE):
+        self.size = size
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        # path -> idle connections, most recently used last
+        self._idle = {}
+        # borrowed connection -> its path
+        self._borrowed = {}
+
+    def _check_pid(self):
+        if self._pid != os.getpid():
+            # the parent's connections must not be used (or closed) here
+            self._pid = os.getpid()
+            self._idle = {}
+            self._borrowed = {}
+
+    def get(self, path):
+        with self._lock:
+            self._check_pid()
+            idle = self._idle.get(path)
+            conn = idle.pop() if idle else None
+        if conn is None:
+            conn = connect(path, check_same_thread=False)
+        with self._lock:
+            self._borrowed[conn] = path
+        return conn
+
+    def release(self, conn):
+        """Return a connection after a request: roll back anything left
+        uncommitted so no transaction (or its locks) outlives the request."""
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            self._check_pid()
+            path = self._borrowed.pop(conn, None)
+            idle = self._idle.setdefault(path, []) if path is not None else None
+            keep = idle is not None and len(idle) < self.size
+            if keep:
+                idle.append(conn)
+        if not keep:
+            conn.close()
+
+    def close_all(self):
+        """Close the idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
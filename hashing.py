@@ -0,0 +1,115 @@
+"""Password hashing off the request thread.
+
+Key derivation is deliberately slow and holds the GIL, so running it inline
+stalls every other request on the same worker. HashingService runs it in a
+small process pool instead. The number of hashes waiting or running is
+capped, and once the cap is reached new requests are rejected at once
+(Overloaded) rather than queuing behind a login storm.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from functools import lru_cache
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+# Any werkzeug method string, e.g. "scrypt", "scrypt:16384:8:1" or
+# "pbkdf2:sha256:600000". Stored hashes made with other parameters are
+# re-hashed the next time their owner logs in.
+HASH_METHOD = os.environ.get("PASSWORD_HASH_METHOD", "scrypt")
+# Worker processes; 0 hashes inline on the calling thread.
+HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Hashes allowed to wait or run at once before new ones are rejected.
+HASH_MAX_PENDING = int(os.environ.get("PASSWORD_HASH_MAX_PENDING", str(max(1, HASH_WORKERS) * 8)))
+# Seconds a request waits for its hash before giving up.
+HASH_TIMEOUT = float(os.environ.get("PASSWORD_HASH_TIMEOUT", "10"))
+
+
+class Overloaded(Exception):
+    """Too many hashes are already pending; try again later."""
+
+
+@lru_cache(maxsize=None)
+def method_prefix(method):
+    """The parameter prefix werkzeug writes for method, e.g. "scrypt:32768:8:1"."""
+    return generate_password_hash("", method).split("$", 1)[0]
+
+
+def needs_rehash(pwhash, method):
+    return pwhash.split("$", 1)[0] != method_prefix(method)
+
+
+# Run in the worker processes.
+def _hash(password, method):
+    return generate_password_hash(password, method)
+
+
+def _verify(pwhash, password, method):
+    """Return (matches, upgraded hash or None)."""
+    if not check_password_hash(pwhash, password):
+        return False, None
+    if needs_rehash(pwhash, method):
+        return True, generate_password_hash(password, method)
+    return True, None
+
+
+class HashingService:
+    def __init__(self, method=HASH_METHOD, workers=HASH_WORKERS,
+                 max_pending=HASH_MAX_PENDING, timeout=HASH_TIMEOUT):
+        self.method = method
+        self.workers = workers
+        self.timeout = timeout
+        self.rejected = 0
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def _executor(self):
+        # started on first use; "spawn" because forking a threaded server
+        # process is unsafe
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"))
+            return self._pool
+
+    def _run(self, fn, *args):
+        if self.workers <= 0:
+            return fn(*args)
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise Overloaded()
+        try:
+            future = self._executor().submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        # the slot stays taken until the hash really finishes, even if the
+        # caller stops waiting for it
+        future.add_done_callback(lambda f: self._slots.release())
+        try:
+            return future.result(self.timeout)
+        except FutureTimeout:
+            raise Overloaded() from None
+
+    def hash(self, password):
+        """Return a new hash of password."""
+        return self._run(_hash, password, self.method)
+
+    def verify(self, pwhash, password):
+        """Check password against pwhash.
+
+        Returns (matches, new_hash). new_hash is set when the password is
+        right but pwhash was made with other parameters than the configured
+        method; the caller should store it in place of the old one.
+        """
+        return self._run(_verify, pwhash, password, self.method)
+
+    def shutdown(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
@@ -0,0 +1,178 @@
+"""Import attendance and marks from CSV exports.
+
+    python importer.py attendance day-2026-03-02.csv
+    python importer.py marks midterms.csv.gz --chunk 10000
+
+Attendance files need username, course, date and present columns (present
+is 1/0, yes/no, true/false, present/absent or P/A). Marks files need
+username, course, assessment, score, max_score and date. Dates are
+YYYY-MM-DD.
+
+Files are streamed through a pipeline of generators: rows are read,
+validated and written one chunk at a time, so memory stays flat however
+big the file is. Each chunk is upserted in a single transaction: a row for
+a student, course and day (or assessment) already stored replaces it, so
+re-importing a corrected export is safe. The database triggers in
+records.py fold every change into the student summaries as it is written.
+Bad rows and unknown usernames are reported and skipped.
+"""
+import argparse
+import csv
+import gzip
+import io
+import sys
+import time
+from datetime import date
+
+from db import MAX_PARAMS, batches, connect
+
+PRESENT = {"1": 1, "yes": 1, "y": 1, "true": 1, "present": 1, "p": 1,
+           "0": 0, "no": 0, "n": 0, "false": 0, "absent": 0, "a": 0}
+
+
+def _date(value):
+    return date.fromisoformat(value.strip()).isoformat()
+
+
+def parse_attendance(row):
+    """Return (username, course, day, present) or raise ValueError."""
+    present = PRESENT.get((row["present"] or "").strip().lower())
+    if present is None:
+        raise ValueError("present must be 1/0, yes/no, present/absent or P/A")
+    return (row["username"].strip(), row["course"].strip(), _date(row["date"]), present)
+
+
+def parse_marks(row):
+    """Return (username, course, assessment, score, max_score, taken_on) or
+    raise ValueError."""
+    score, max_score = float(row["score"]), float(row["max_score"])
+    if max_score <= 0 or not 0 <= score <= max_score:
+        raise ValueError("score must be between 0 and max_score, and max_score above 0")
+    return (row["username"].strip(), row["course"].strip(), row["assessment"].strip(),
+            score, max_score, _date(row["date"]))
+
+
+# kind -> (required columns, row parser, upsert)
+KINDS = {
+    "attendance": (
+        ("username", "course", "date", "present"),
+        parse_attendance,
+        """INSERT INTO attendance (user_id, course, day, present) VALUES (?, ?, ?, ?)
+           ON CONFLICT (user_id, course, day) DO UPDATE SET present = excluded.present
+           WHERE present != excluded.present""",
+    ),
+    "marks": (
+        ("username", "course", "assessment", "score", "max_score", "date"),
+        parse_marks,
+        """INSERT INTO marks (user_id, course, assessment, score, max_score, taken_on)
+           VALUES (?, ?, ?, ?, ?, ?)
+           ON CONFLICT (user_id, course, assessment) DO UPDATE
+           SET score = excluded.score, max_score = excluded.max_score,
+               taken_on = excluded.taken_on
+           WHERE (score, max_score, taken_on)
+                 != (excluded.score, excluded.max_score, excluded.taken_on)""",
+    ),
+}
+
+
+def read_csv(path, columns):
+    """Yield (line number, row dict) from a CSV file, gzipped or not."""
+    raw = gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb")
+    with io.TextIOWrapper(raw, encoding="utf-8-sig", newline="") as f:
+        reader = csv.DictReader(f)
+        missing = set(columns) - set(reader.fieldnames or ())
+        if missing:
+            raise SystemExit("%s: missing column(s): %s" % (path, ", ".join(sorted(missing))))
+        for row in reader:
+            yield reader.line_num, row
+
+
+class Importer:
+    def __init__(self, db, kind, out=sys.stderr):
+        self.db = db
+        self.columns, self.parse, self.upsert = KINDS[kind]
+        self.out = out
+        self.read = 0
+        self.written = 0
+        self.unchanged = 0
+        self.invalid = 0
+        self.unknown = 0
+        self.transactions = 0
+        # username -> user id; bounded by the number of students
+        self._ids = {}
+
+    def validated(self, rows):
+        """Yield (line number, parsed record) for the rows that are valid."""
+        for line_num, row in rows:
+            self.read += 1
+            try:
+                if any(not (row[c] or "").strip() for c in self.columns):
+                    raise ValueError("empty field")
+                record = self.parse(row)
+            except (ValueError, TypeError) as e:
+                self.invalid += 1
+                print("line %d: %s" % (line_num, e), file=self.out)
+                continue
+            yield line_num, record
+
+    def _resolve(self, usernames):
+        missing = [u for u in usernames if u not in self._ids]
+        for i in range(0, len(missing), MAX_PARAMS):
+            chunk = missing[i:i + MAX_PARAMS]
+            sql = "SELECT username, id FROM users WHERE username IN (%s)" % ",".join("?" * len(chunk))
+            self._ids.update(self.db.execute(sql, chunk).fetchall())
+
+    def write_chunk(self, records):
+        """Upsert one chunk of (line number, record) in a transaction."""
+        self._resolve({r[0] for _, r in records})
+        params = []
+        for line_num, record in records:
+            user_id = self._ids.get(record[0])
+            if user_id is None:
+                self.unknown += 1
+                print("line %d: no student %r" % (line_num, record[0]), file=self.out)
+                continue
+            params.append((user_id,) + record[1:])
+        with self.db:
+            cur = self.db.executemany(self.upsert, params)
+        self.written += cur.rowcount
+        self.unchanged += len(params) - cur.rowcount
+        self.transactions += 1
+
+
+def main(argv=None):
+    import app
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("kind", choices=sorted(KINDS), help="what the file holds")
+    parser.add_argument("path", help="CSV file (may be gzipped)")
+    parser.add_argument("--db", default=app.DATABASE, help="database file (default: %(default)s)")
+    parser.add_argument("--chunk", type=int, default=5000, help="rows per transaction")
+    args = parser.parse_args(argv)
+
+    app.DATABASE = args.db
+    app.init_db()
+    db = connect(args.db)
+    importer = Importer(db, args.kind)
+
+    start = time.perf_counter()
+    rows = importer.validated(read_csv(args.path, importer.columns))
+    for n, chunk in enumerate(batches(rows, args.chunk), 1):
+        importer.write_chunk(chunk)
+        if n % 20 == 0:
+            elapsed = time.perf_counter() - start
+            print("%d rows read, %.0f rows/s" % (importer.read, importer.read / elapsed),
+                  file=sys.stderr)
+    elapsed = time.perf_counter() - start
+    db.close()
+
+    print("read %d rows: %d written, %d unchanged, %d invalid, %d unknown students"
+          " in %d transaction(s), %.1fs (%.0f rows/s)"
+          % (importer.read, importer.written, importer.unchanged, importer.invalid,
+             importer.unknown, importer.transactions, elapsed,
+             importer.read / elapsed if elapsed else 0))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
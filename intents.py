@@ -0,0 +1,294 @@
+"""Chatbot intent rules and the keyword matchers compiled from them.
+
+The rules themselves live in intents.json: one object per rule with an
+id, a name, "match" ("any" or "all"), its keywords and the response.
+"""
+import json
+import re
+import threading
+from collections import OrderedDict, deque, namedtuple
+
+EMPTY_REPLY = "Please type a question so I can help you."
+FALLBACK_REPLY = "I’m still learning. Could you ask in a different way or be more specific?"
+# Intent names reported when no rule answers.
+EMPTY_INTENT = "empty"
+FALLBACK_INTENT = "fallback"
+
+# A rule fires when any of its keywords ("any") or all of them ("all") occur
+# in the lower-cased message. Lower id = higher priority; the first rule that
+# matches wins.
+Rule = namedtuple("Rule", "id name match keywords response")
+
+# ---------- Rule table ----------
+def parse_rules(data):
+    """Validate decoded intents.json data and return its rules by id."""
+    if not isinstance(data, list):
+        raise ValueError("the intents file must hold a list of rules")
+    rules = []
+    ids = set()
+    names = set()
+    for n, entry in enumerate(data, 1):
+        where = "rule #%d" % n
+        if not isinstance(entry, dict):
+            raise ValueError("%s: expected an object" % where)
+        missing = {"id", "name", "match", "keywords", "response"} - set(entry)
+        if missing:
+            raise ValueError("%s: missing %s" % (where, ", ".join(sorted(missing))))
+        rule_id, name, match = entry["id"], entry["name"], entry["match"]
+        keywords, response = entry["keywords"], entry["response"]
+        if not isinstance(rule_id, int) or rule_id in ids:
+            raise ValueError("%s: id must be a unique integer" % where)
+        if not isinstance(name, str) or not name or name in names:
+            raise ValueError("%s: name must be a unique, non-empty string" % where)
+        if match not in ("any", "all"):
+            raise ValueError('%s: match must be "any" or "all"' % where)
+        if (not isinstance(keywords, list) or not keywords
+                or not all(isinstance(kw, str) and kw and kw == kw.lower() for kw in keywords)):
+            raise ValueError("%s: keywords must be a non-empty list of lower-case strings" % where)
+        if not isinstance(response, str) or not response:
+            raise ValueError("%s: response must be a non-empty string" % where)
+        ids.add(rule_id)
+        names.add(name)
+        rules.append(Rule(rule_id, name, match, tuple(keywords), response))
+    return sorted(rules, key=lambda r: r.id)
+
+
+def load_rules(path):
+    """Read and validate the rules in a JSON intents file."""
+    with open(path, encoding="utf-8") as f:
+        return parse_rules(json.load(f))
+
+
+# ---------- Matchers ----------
+class _Matcher:
+    """Shared rule bookkeeping: subclasses only decide which keywords a
+    message contains (as a bitmask over self.keywords)."""
+
+    def __init__(self, rules):
+        self.rules = sorted(rules, key=lambda r: r.id)
+        self.keywords = sorted({kw for r in self.rules for kw in r.keywords})
+        self._index = {kw: i for i, kw in enumerate(self.keywords)}
+
+        # rule position -> bitmask of its keywords
+        self._needs = []
+        # keyword index -> positions of the rules that use it
+        self._users = [[] for _ in self.keywords]
+        for pos, rule in enumerate(self.rules):
+            mask = 0
+            for kw in rule.keywords:
+                mask |= 1 << self._index[kw]
+                self._users[self._index[kw]].append(pos)
+            self._needs.append(mask)
+
+    def scan(self, t):
+        raise NotImplementedError
+
+    def match(self, t):
+        """Return the winning rule for the lower-cased text t, or None."""
+        return self.winner(self.scan(t))
+
+    def winner(self, found):
+        """Return the first rule satisfied by a bitmask of found keywords."""
+        if not found:
+            return None
+        candidates = set()
+        rest = found
+        while rest:
+            low = rest & -rest
+            candidates.update(self._users[low.bit_length() - 1])
+            rest ^= low
+        for pos in sorted(candidates):
+            rule = self.rules[pos]
+            need = self._needs[pos]
+            if rule.match == "all":
+                if found & need == need:
+                    return rule
+            elif found & need:
+                return rule
+        return None
+
+
+class KeywordMatcher(_Matcher):
+    """Aho-Corasick automaton over every rule keyword.
+
+    Keywords match anywhere in the message, as plain substrings, so this
+    gives exactly the replies of the original if-chain. The message is
+    scanned once, collecting every keyword it contains.
+    """
+
+    def __init__(self, rules):
+        super().__init__(rules)
+        self._build()
+
+    def _build(self):
+        # trie
+        goto = [{}]
+        out = [0]
+        for kw, i in self._index.items():
+            state = 0
+            for ch in kw:
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[state][ch] = nxt
+                    goto.append({})
+                    out.append(0)
+                state = nxt
+            out[state] |= 1 << i
+
+        # failure links, folded into a full transition table so scanning
+        # never has to follow them at run time
+        delta = [None] * len(goto)
+        delta[0] = dict(goto[0])
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            f = fail[state]
+            out[state] |= out[f]
+            delta[state] = dict(delta[f])
+            delta[state].update(goto[state])
+            for ch, nxt in goto[state].items():
+                fail[nxt] = delta[f].get(ch, 0)
+                queue.append(nxt)
+
+        self._delta = delta
+        self._out = out
+
+    def scan(self, t):
+        """Return a bitmask of the keywords found in t."""
+        delta = self._delta
+        out = self._out
+        state = 0
+        found = 0
+        for ch in t:
+            state = delta[state].get(ch, 0)
+            if out[state]:
+                found |= out[state]
+        return found
+
+
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:'[a-z]+)?\+*")
+# Shortest word left after dropping a plural "s"; shorter ones are more
+# often not plurals at all ("his", "cvs").
+MIN_PLURAL_STEM = 4
+
+def tokenize(t):
+    """Split lower-cased text into word tokens ("c++" and "can't" stay whole)."""
+    return TOKEN_RE.findall(t.replace("’", "'"))
+
+
+class TokenMatcher(_Matcher):
+    """Word-boundary matcher backed by an inverted index.
+
+    Every keyword is tokenized and indexed by its word n-gram, so a keyword
+    only matches whole words: "hi" no longer fires inside "this". A trailing
+    plural "s" in the message is ignored when at least MIN_PLURAL_STEM
+    letters remain ("assignments" matches "assignment", "his" does not
+    match "hi"). A scan costs about one dict probe per word of the
+    message, however many rules there are.
+    """
+
+    def __init__(self, rules):
+        super().__init__(rules)
+        self._grams = {}
+        # leading words of multi-word keywords, so a scan only extends an
+        # n-gram while it can still become a keyword
+        self._prefixes = set()
+        for kw, i in self._index.items():
+            tokens = tokenize(kw)
+            if not tokens:
+                continue
+            key = " ".join(tokens)
+            self._grams[key] = self._grams.get(key, 0) | 1 << i
+            for n in range(1, len(tokens)):
+                self._prefixes.add(" ".join(tokens[:n]))
+
+    def scan(self, t):
+        """Return a bitmask of the keywords found in t."""
+        grams = self._grams
+        prefixes = self._prefixes
+        tokens = tokenize(t)
+        found = 0
+        for start, key in enumerate(tokens):
+            end = start + 1
+            while True:
+                hit = grams.get(key)
+                if hit is None and key.endswith("s") and len(tokens[end - 1]) > MIN_PLURAL_STEM:
+                    hit = grams.get(key[:-1])
+                if hit:
+                    found |= hit
+                if end == len(tokens) or key not in prefixes:
+                    break
+                key = key + " " + tokens[end]
+                end += 1
+        return found
+
+
+# Matching modes selectable by the app ("substring" is the legacy behaviour).
+MATCHERS = {
+    "substring": KeywordMatcher,
+    "token": TokenMatcher,
+}
+
+
+# ---------- Reply cache ----------
+def normalize(text):
+    """Lower-case text and collapse runs of whitespace to single spaces."""
+    return " ".join(text.lower().split())
+
+
+class ResponseCache:
+    """Size-bounded, thread-safe LRU cache of chatbot answers.
+
+    Keys are normalized messages. clear() bumps `version`; a put() made with
+    a version read before the clear is dropped, so a reply computed from the
+    old rules can never land in the cache after the rules change.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached value for key, or None."""
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value, version):
+        with self._lock:
+            if version != self.version or self.maxsize <= 0:
+                return
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.version += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
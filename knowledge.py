@@ -0,0 +1,122 @@
+"""The chatbot's knowledge base: the intents file and everything compiled
+from it.
+
+A KnowledgeBase holds one immutable Compiled snapshot (rules, keyword
+matcher, spelling corrector, semantic index). Requests read `current` once and use that
+snapshot throughout. A reload builds the next snapshot completely on a
+background thread and then replaces `current` with a single assignment, so
+a request sees either the old rules or the new ones, never a mix.
+"""
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+
+import semantic
+from intents import MATCHERS, load_rules, tokenize
+from shadowing import prune
+from spelling import SpellingCorrector
+
+log = logging.getLogger(__name__)
+
+Compiled = namedtuple("Compiled", "rules matcher spelling semantic")
+
+
+def compile_rules(rules, mode="substring", semantic_threshold=0.35, prune_rules=True,
+                  typo_distance=2, known_words=()):
+    """Build the matchers for a rule set.
+
+    With prune_rules, rules that can never match (see shadowing.py) are left
+    out of the keyword matcher. The semantic index still sees every rule.
+    The spelling corrector maps typos to the words of the matcher's
+    keywords; words from any response, and known_words, count as spelled
+    right. It is left out when typo_distance is 0.
+    """
+    matcher = MATCHERS[mode](prune(rules, mode) if prune_rules else rules)
+    return Compiled(
+        rules=tuple(rules),
+        matcher=matcher,
+        spelling=(SpellingCorrector(matcher.rules, typo_distance,
+                                    known={w for r in rules for w in tokenize(r.response.lower())}
+                                    | set(known_words))
+                  if typo_distance > 0 else None),
+        semantic=(semantic.SemanticMatcher(rules, semantic_threshold)
+                  if semantic.AVAILABLE else None),
+    )
+
+
+class KnowledgeBase:
+    def __init__(self, path, mode="substring", semantic_threshold=0.35, prune_rules=True,
+                 on_swap=None, typo_distance=2, known_words=()):
+        self.path = path
+        self.mode = mode
+        self.semantic_threshold = semantic_threshold
+        self.prune_rules = prune_rules
+        self.typo_distance = typo_distance
+        self.known_words = known_words
+        # called after every swap, e.g. to drop cached replies
+        self.on_swap = on_swap
+        self.reloads = 0
+        self._signature = self._stat()
+        self._watcher = None
+        self._watch_lock = threading.Lock()
+        # serializes reloads
+        self._lock = threading.Lock()
+        self.current = self._compile(load_rules(path))
+
+    def _compile(self, rules):
+        return compile_rules(rules, self.mode, self.semantic_threshold, self.prune_rules,
+                             self.typo_distance, self.known_words)
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def load(self, rules):
+        """Compile rules and make them the live rule set."""
+        compiled = self._compile(rules)
+        self.current = compiled
+        self.reloads += 1
+        if self.on_swap is not None:
+            self.on_swap()
+
+    def reload(self):
+        """Re-read the intents file. On a bad file the old rules stay live."""
+        with self._lock:
+            # remember the signature even if the file is bad, so it is only
+            # retried once it changes again
+            self._signature = self._stat()
+            try:
+                rules = load_rules(self.path)
+            except (OSError, ValueError) as e:
+                log.error("not reloading %s: %s", self.path, e)
+                return False
+            self.load(rules)
+            log.info("reloaded %d rules from %s", len(rules), self.path)
+            return True
+
+    def changed(self):
+        return self._stat() != self._signature
+
+    def watch(self, interval=2.0):
+        """Poll the intents file every `interval` seconds in a daemon thread
+        and reload it when it changes. Cheap to call on every request."""
+        watcher = self._watcher
+        if watcher is not None and watcher.is_alive():
+            return
+        with self._watch_lock:
+            if self._watcher is not None and self._watcher.is_alive():
+                return
+            self._watcher = threading.Thread(target=self._watch, args=(interval,),
+                                             name="intents-watcher", daemon=True)
+            self._watcher.start()
+
+    def _watch(self, interval):
+        while True:
+            time.sleep(interval)
+            if self.changed():
+                self.reload()
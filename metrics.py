@@ -0,0 +1,162 @@
+"""In-process metrics with Prometheus text exposition.
+
+Recording must stay off the critical path, so every thread writes to its
+own shard (plain dicts, no locks); shards are only summed when /metrics is
+scraped. Shards of threads that have exited are folded into one retired
+shard, so servers that start a thread per request don't leak memory.
+Each worker process keeps its own registry; scrape every worker.
+"""
+import threading
+import weakref
+from bisect import bisect_left
+
+# Histogram bucket upper bounds, in seconds.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Fold dead threads' shards once this many are registered.
+_FOLD_AT = 64
+
+
+class _Shard:
+    __slots__ = ("counters", "histograms")
+
+    def __init__(self):
+        # (name, labels) -> value
+        self.counters = {}
+        # (name, labels) -> [per-bucket counts (last is +Inf), sum]
+        self.histograms = {}
+
+    def merge(self, other):
+        for key, value in other.counters.items():
+            self.counters[key] = self.counters.get(key, 0) + value
+        for key, (counts, total) in other.histograms.items():
+            mine = self.histograms.get(key)
+            if mine is None:
+                self.histograms[key] = [list(counts), total]
+            else:
+                for i, n in enumerate(counts):
+                    mine[0][i] += n
+                mine[1] += total
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels, extra=None):
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (k, _escape(v)) for k, v in pairs)
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = []          # (weakref to thread, shard)
+        self._retired = _Shard()
+        self._meta = {}            # name -> (type, help)
+
+    def describe(self, name, kind, help_text):
+        """Declare a metric's type ("counter", "histogram", "gauge") and help."""
+        self._meta[name] = (kind, help_text)
+
+    def _shard(self):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = _Shard()
+            with self._lock:
+                if len(self._shards) >= _FOLD_AT:
+                    self._fold_dead()
+                self._shards.append((weakref.ref(threading.current_thread()), shard))
+        return shard
+
+    def _fold_dead(self):
+        # caller holds the lock; a dead thread can no longer write its shard
+        alive = []
+        for ref, shard in self._shards:
+            thread = ref()
+            if thread is None or not thread.is_alive():
+                self._retired.merge(shard)
+            else:
+                alive.append((ref, shard))
+        self._shards = alive
+
+    def inc(self, name, labels=(), value=1):
+        counters = self._shard().counters
+        key = (name, labels)
+        counters[key] = counters.get(key, 0) + value
+
+    def observe(self, name, labels, seconds):
+        histograms = self._shard().histograms
+        key = (name, labels)
+        h = histograms.get(key)
+        if h is None:
+            h = histograms[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        h[0][bisect_left(self.buckets, seconds)] += 1
+        h[1] += seconds
+
+    def snapshot(self):
+        """Sum every shard into one."""
+        with self._lock:
+            self._fold_dead()
+            total = _Shard()
+            total.merge(self._retired)
+            for _, shard in self._shards:
+                # copy first: the owning thread may be adding keys
+                snap = _Shard()
+                snap.counters = dict(shard.counters)
+                snap.histograms = {k: [list(v[0]), v[1]] for k, v in list(shard.histograms.items())}
+                total.merge(snap)
+        return total
+
+    def counter_totals(self, name):
+        """Return {labels: value} for one counter."""
+        return {labels: value for (n, labels), value in self.snapshot().counters.items()
+                if n == name}
+
+    def render(self, extra=()):
+        """Return every metric in the Prometheus text format.
+
+        extra holds values kept elsewhere (cache stats and the like) as
+        (name, type, help, [(labels, value), ...]) tuples.
+        """
+        snap = self.snapshot()
+        by_name = {}
+        for (name, labels), value in snap.counters.items():
+            by_name.setdefault(name, []).append(("counter", labels, value))
+        for (name, labels), value in snap.histograms.items():
+            by_name.setdefault(name, []).append(("histogram", labels, value))
+
+        lines = []
+        for name in sorted(by_name):
+            kind, help_text = self._meta.get(name, (by_name[name][0][0], ""))
+            lines.append("# HELP %s %s" % (name, help_text))
+            lines.append("# TYPE %s %s" % (name, kind))
+            for kind, labels, value in sorted(by_name[name], key=lambda s: s[1]):
+                if kind == "counter":
+                    lines.append("%s%s %s" % (name, _labels(labels), _number(value)))
+                    continue
+                counts, total = value
+                running = 0
+                for bound, n in zip(self.buckets + (float("inf"),), counts):
+                    running += n
+                    lines.append("%s_bucket%s %d" % (name, _labels(labels, ("le", _number(bound))),
+                                                     running))
+                lines.append("%s_sum%s %s" % (name, _labels(labels), repr(total)))
+                lines.append("%s_count%s %d" % (name, _labels(labels), running))
+        for name, kind, help_text, samples in extra:
+            lines.append("# HELP %s %s" % (name, help_text))
+            lines.append("# TYPE %s %s" % (name, kind))
+            for labels, value in samples:
+                lines.append("%s%s %s" % (name, _labels(labels), _number(value)))
+        return "\n".join(lines) + "\n"
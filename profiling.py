@@ -0,0 +1,129 @@
+"""Sampling profiler for a live worker.
+
+Off by default. When on, each request is picked with probability `rate`,
+or every request is picked until a time window closes. While a picked
+request runs, a background thread looks at its stack every `interval`
+seconds and counts it. The request itself runs normally, and any number of
+concurrent requests can be sampled at once.
+
+Counts are written to `directory` in collapsed-stack format, one
+"label;frame;...;frame count" line per distinct stack, which flamegraph.pl
+and speedscope read directly. A new file is started every `flush_every`
+seconds and whenever sampling goes idle. When nothing is being profiled the
+only cost is one should_sample() check per request.
+"""
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+
+class SamplingProfiler:
+    def __init__(self, directory, rate=0.0, interval=0.005, flush_every=10.0, root=None):
+        self.directory = directory
+        self.rate = rate
+        self.interval = interval
+        self.flush_every = flush_every
+        # stacks start at this code object (e.g. Flask.wsgi_app), leaving
+        # out the server loop above it
+        self.root = root
+        self.until = 0.0
+        self.samples = 0
+        self.files = 0
+        self._active = {}       # thread ident -> label
+        self._stacks = Counter()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def configure(self, rate=None, seconds=None):
+        """Set the sampled fraction of requests and/or profile every request
+        for the next `seconds` (0 ends a running window)."""
+        if rate is not None:
+            if not 0.0 <= rate <= 1.0:
+                raise ValueError("rate must be between 0 and 1")
+            self.rate = rate
+        if seconds is not None:
+            if seconds < 0:
+                raise ValueError("seconds must not be negative")
+            self.until = time.monotonic() + seconds if seconds else 0.0
+
+    def status(self):
+        return {
+            "rate": self.rate,
+            "window_left": max(0.0, self.until - time.monotonic()),
+            "active": len(self._active),
+            "samples": self.samples,
+            "files": self.files,
+            "directory": os.path.abspath(self.directory),
+        }
+
+    def should_sample(self):
+        if self.until and time.monotonic() < self.until:
+            return True
+        return self.rate > 0.0 and random.random() < self.rate
+
+    def start(self, label):
+        """Sample the calling thread, under label, until stop()."""
+        self._active[threading.get_ident()] = label
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="profiler-sampler",
+                                                    daemon=True)
+                    self._thread.start()
+        self._wake.set()
+
+    def stop(self):
+        self._active.pop(threading.get_ident(), None)
+
+    def _run(self):
+        last_flush = time.monotonic()
+        while True:
+            if not self._active:
+                self.flush()
+                self._wake.wait()
+                self._wake.clear()
+                last_flush = time.monotonic()
+                continue
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for ident, label in list(self._active.items()):
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        self._stacks[self._collapse(label, frame)] += 1
+                        self.samples += 1
+            del frames
+            if time.monotonic() - last_flush >= self.flush_every:
+                self.flush()
+                last_flush = time.monotonic()
+
+    def _collapse(self, label, frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append("%s:%s" % (os.path.basename(code.co_filename),
+                                    getattr(code, "co_qualname", code.co_name)))
+            if code is self.root:
+                break
+            frame = frame.f_back
+        names.append(label)
+        return ";".join(reversed(names))
+
+    def flush(self):
+        """Write the stacks counted so far to a new file; return its path."""
+        with self._lock:
+            stacks, self._stacks = self._stacks, Counter()
+        if not stacks:
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, "profile-%s-%d.folded"
+                            % (time.strftime("%Y%m%d-%H%M%S"), os.getpid()))
+        with open(path, "a", encoding="utf-8") as f:
+            for stack, count in sorted(stacks.items()):
+                f.write("%s %d\n" % (stack, count))
+        self.files += 1
+        return path
@@ -0,0 +1,191 @@
+"""Create student accounts in bulk.
+
+    python provision.py students.csv
+    python provision.py students.jsonl --workers 8
+
+CSV files need a header with "username" and "password" columns; JSONL files
+hold one {"username": ..., "password": ...} object per line. The input is
+streamed: it is read one batch at a time, hashed in parallel on all cores
+and written with executemany, one transaction per --commit-every accounts.
+Memory use depends on those two settings, not on the size of the file.
+Usernames that already exist (or repeat within the file) are reported and
+skipped; the run carries on.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from werkzeug.security import generate_password_hash
+
+import app
+from db import MAX_PARAMS, batches, connect
+from hashing import HASH_METHOD
+
+
+def read_rows(path, fmt):
+    """Yield (line number, username, password) from a CSV or JSONL file.
+
+    Rows without a username or password, or with one that is not a string,
+    are yielded with None in its place so the caller can report them.
+    """
+    with open(path, newline="", encoding="utf-8") as f:
+        if fmt == "csv":
+            reader = csv.DictReader(f)
+            missing = {"username", "password"} - set(reader.fieldnames or ())
+            if missing:
+                raise SystemExit("%s: missing column(s): %s" % (path, ", ".join(sorted(missing))))
+            for row in reader:
+                yield reader.line_num, (row["username"] or "").strip() or None, row["password"] or None
+        else:
+            for line_num, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    row = None
+                if not isinstance(row, dict):
+                    yield line_num, None, None
+                    continue
+                username, password = row.get("username"), row.get("password")
+                yield (line_num,
+                       username.strip() or None if isinstance(username, str) else None,
+                       password or None if isinstance(password, str) else None)
+
+
+def existing_usernames(db, usernames):
+    """Return the subset of usernames already in the users table."""
+    found = set()
+    usernames = list(usernames)
+    for i in range(0, len(usernames), MAX_PARAMS):
+        chunk = usernames[i:i + MAX_PARAMS]
+        sql = "SELECT username FROM users WHERE username IN (%s)" % ",".join("?" * len(chunk))
+        found.update(r[0] for r in db.execute(sql, chunk))
+    return found
+
+
+class Provisioner:
+    def __init__(self, db, pool, workers, method, commit_every, out=sys.stderr):
+        self.db = db
+        self.pool = pool
+        self.workers = workers
+        self.method = method
+        self.commit_every = commit_every
+        self.out = out
+        self.created = 0
+        self.duplicates = 0
+        self.invalid = 0
+        self.transactions = 0
+        # hashed accounts waiting for the next transaction
+        self._pending = []
+        self._pending_names = set()
+
+    def add_batch(self, rows):
+        """Check, hash and queue one batch of (line, username, password)."""
+        fresh = []
+        names = set()
+        for line_num, username, password in rows:
+            if not isinstance(username, str) or not isinstance(password, str):
+                self.invalid += 1
+                print("line %d: missing or invalid username or password" % line_num,
+                      file=self.out)
+            elif username in names or username in self._pending_names:
+                self._duplicate(line_num, username)
+            else:
+                names.add(username)
+                fresh.append((line_num, username, password))
+
+        taken = existing_usernames(self.db, names)
+        accounts = []
+        for line_num, username, password in fresh:
+            if username in taken:
+                self._duplicate(line_num, username)
+            else:
+                accounts.append((line_num, username, password))
+
+        chunksize = max(1, len(accounts) // (self.workers * 4))
+        hashes = self.pool.map(generate_password_hash, (a[2] for a in accounts),
+                               repeat(self.method), chunksize=chunksize)
+        for (line_num, username, _), hashed in zip(accounts, hashes):
+            self._pending.append((line_num, username, hashed))
+            self._pending_names.add(username)
+
+        if len(self._pending) >= self.commit_every:
+            self.flush()
+
+    def flush(self):
+        """Write the queued accounts in one transaction."""
+        if not self._pending:
+            return
+        db = self.db
+        with db:
+            cur = db.executemany(
+                "INSERT OR IGNORE INTO users (username, password) VALUES (?, ?)",
+                [(username, hashed) for _, username, hashed in self._pending])
+            inserted = cur.rowcount
+            if inserted < len(self._pending):
+                # someone registered one of these names since the batch was
+                # checked; find out which
+                stored = {}
+                names = [username for _, username, _ in self._pending]
+                for i in range(0, len(names), MAX_PARAMS):
+                    chunk = names[i:i + MAX_PARAMS]
+                    sql = ("SELECT username, password FROM users WHERE username IN (%s)"
+                           % ",".join("?" * len(chunk)))
+                    stored.update(db.execute(sql, chunk).fetchall())
+                for line_num, username, hashed in self._pending:
+                    if stored.get(username) != hashed:
+                        self._duplicate(line_num, username)
+        self.created += inserted
+        self.transactions += 1
+        self._pending = []
+        self._pending_names = set()
+
+    def _duplicate(self, line_num, username):
+        self.duplicates += 1
+        print("line %d: username %r already taken" % (line_num, username), file=self.out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path", help="CSV or JSONL file of usernames and passwords")
+    parser.add_argument("--format", choices=("csv", "jsonl"),
+                        help="input format (default: from the file extension)")
+    parser.add_argument("--db", default=app.DATABASE, help="database file (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="hashing processes (default: one per core)")
+    parser.add_argument("--batch-size", type=int, default=1000,
+                        help="rows read and hashed at a time")
+    parser.add_argument("--commit-every", type=int, default=20000,
+                        help="accounts written per transaction")
+    parser.add_argument("--method", default=HASH_METHOD,
+                        help="werkzeug hash method (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    fmt = args.format or ("jsonl" if args.path.endswith((".jsonl", ".json")) else "csv")
+    app.DATABASE = args.db
+    app.init_db()
+    db = connect(args.db)
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        provisioner = Provisioner(db, pool, args.workers, args.method, args.commit_every)
+        for batch in batches(read_rows(args.path, fmt), args.batch_size):
+            provisioner.add_batch(batch)
+        provisioner.flush()
+    elapsed = time.perf_counter() - start
+    db.close()
+
+    print("created %d, duplicates %d, invalid %d in %d transaction(s), %.1fs (%.0f accounts/s)"
+          % (provisioner.created, provisioner.duplicates, provisioner.invalid,
+             provisioner.transactions, elapsed, provisioner.created / elapsed if elapsed else 0))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,226 @@
+"""Course recommendations, computed offline and served from a cache.
+
+    python recommend.py              # rebuild the recommendations table
+    python recommend.py --top 5
+
+The job reads every student's courses: a course counts as taken when the
+student has attendance or marks in it. Each taken course is weighted by
+the student's average mark there (attendance alone counts as a middling
+0.5). From that student-by-course matrix it builds a course-by-course
+cosine similarity matrix. Every untaken course is scored by its similarity
+to the courses the student took, weighted by how well they did in them.
+Students are scored in blocks, so memory stays bounded. The top courses
+per student go to the `recommendations` table, topped up with the most
+taken courses they have not taken when too few courses are similar. The
+most taken courses overall are stored under user_id 0 for students without
+any records.
+
+On the request path, RecommendationCache reads a student's row once and
+keeps it in memory, so a lookup is a dict hit and never runs the model.
+
+The job needs numpy; the app does not.
+"""
+import argparse
+import sys
+import time
+from collections import namedtuple
+
+from db import connect
+from intents import ResponseCache
+
+try:
+    import numpy as np
+except ImportError:  # optional dependency
+    np = None
+
+AVAILABLE = np is not None
+
+# Courses stored per student.
+TOP_K = 3
+# Weight of a taken course the student has no marks in yet.
+ATTENDED_WEIGHT = 0.5
+# Students scored per matrix product.
+BLOCK = 10000
+# Row that holds the most popular courses.
+POPULAR = 0
+
+# What RecommendationCache.get returns: the courses, and whether they were
+# picked for this student (False: the popular courses, for a student
+# without records).
+Recommendations = namedtuple("Recommendations", "courses personal")
+
+
+def init_recommendations(db):
+    """Create the recommendation tables if missing (part of init_db)."""
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS recommendations (
+            user_id INTEGER NOT NULL,
+            rank INTEGER NOT NULL,
+            course TEXT NOT NULL,
+            score REAL NOT NULL,
+            PRIMARY KEY (user_id, rank)
+        ) WITHOUT ROWID
+    """)
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS recommendation_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now')),
+            students INTEGER NOT NULL,
+            courses INTEGER NOT NULL
+        )
+    """)
+
+
+def load_matrix(db):
+    """Return (student ids, course names, student-by-course weights)."""
+    weights = {}
+    for user_id, course in db.execute("SELECT DISTINCT user_id, course FROM attendance"):
+        weights[user_id, course] = ATTENDED_WEIGHT
+    for user_id, course, average in db.execute("""
+            SELECT user_id, course, avg(score / max_score) FROM marks GROUP BY user_id, course
+            """):
+        weights[user_id, course] = average
+    students = sorted({s for s, _ in weights})
+    courses = sorted({c for _, c in weights})
+    row = {s: i for i, s in enumerate(students)}
+    col = {c: j for j, c in enumerate(courses)}
+    matrix = np.zeros((len(students), len(courses)), dtype=np.float32)
+    for (s, c), w in weights.items():
+        # a course with a zero average still counts as taken
+        matrix[row[s], col[c]] = max(w, 1e-3)
+    return students, courses, matrix
+
+
+def course_similarity(matrix):
+    """Cosine similarity between the courses (columns), diagonal zeroed."""
+    norms = np.linalg.norm(matrix, axis=0)
+    norms[norms == 0] = 1.0
+    unit = matrix / norms
+    similarity = unit.T @ unit
+    np.fill_diagonal(similarity, 0.0)
+    return similarity
+
+
+def top_courses(matrix, similarity, k=TOP_K):
+    """Yield (row, [(course index, score), ...]) with each student's best
+    untaken courses, BLOCK students at a time."""
+    k = min(k, matrix.shape[1])
+    for start in range(0, matrix.shape[0], BLOCK):
+        block = matrix[start:start + BLOCK]
+        scores = block @ similarity
+        scores[block > 0] = -np.inf
+        if k < scores.shape[1]:
+            best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            best = np.tile(np.arange(scores.shape[1]), (scores.shape[0], 1))
+        picked = np.take_along_axis(scores, best, axis=1)
+        order = np.argsort(-picked, axis=1, kind="stable")
+        best = np.take_along_axis(best, order, axis=1)
+        picked = np.take_along_axis(picked, order, axis=1)
+        for i in range(scores.shape[0]):
+            yield start + i, [(int(j), float(v)) for j, v in zip(best[i], picked[i]) if v > 0]
+
+
+def build(db, k=TOP_K):
+    """Recompute and store every student's recommendations; returns
+    (students, courses)."""
+    students, courses, matrix = load_matrix(db)
+    rows = []
+    if courses:
+        similarity = course_similarity(matrix)
+        taken = (matrix > 0).sum(axis=0)
+        popular = np.argsort(-taken, kind="stable").tolist()
+        for i, picks in top_courses(matrix, similarity, k):
+            if len(picks) < k:
+                # too few similar courses: top up with the most popular
+                # ones the student has not taken
+                chosen = {j for j, _ in picks}
+                picks += [(j, 0.0) for j in popular
+                          if j not in chosen and matrix[i, j] == 0][:k - len(picks)]
+            rows.extend((students[i], rank, courses[j], score)
+                        for rank, (j, score) in enumerate(picks, 1))
+        for rank, j in enumerate(popular[:k], 1):
+            rows.append((POPULAR, rank, courses[j], float(taken[j])))
+    with db:
+        db.execute("DELETE FROM recommendations")
+        db.executemany("INSERT INTO recommendations (user_id, rank, course, score)"
+                       " VALUES (?, ?, ?, ?)", rows)
+        db.execute("INSERT INTO recommendation_runs (students, courses) VALUES (?, ?)",
+                   (len(students), len(courses)))
+    return len(students), len(courses)
+
+
+class RecommendationCache:
+    """Read-through cache of each student's recommended courses.
+
+    The table is re-read for a student on first use only. At most every
+    check_every seconds the cache looks for a newer run of the job and
+    starts over if there is one.
+    """
+
+    def __init__(self, maxsize=4096, check_every=30.0):
+        self.check_every = check_every
+        self._cache = ResponseCache(maxsize)
+        self._run = None
+        self._checked = None
+
+    def get(self, db, user_id):
+        """Return the Recommendations for user_id (courses possibly empty)."""
+        now = time.monotonic()
+        if self._checked is None or now - self._checked >= self.check_every:
+            self._checked = now
+            run = db.execute("SELECT max(id) FROM recommendation_runs").fetchone()[0]
+            if run != self._run:
+                self._run = run
+                self._cache.clear()
+        found = self._cache.get(user_id)
+        if found is not None:
+            return found
+        version = self._cache.version
+        rows = db.execute("SELECT course FROM recommendations WHERE user_id = ? ORDER BY rank",
+                          (user_id,)).fetchall()
+        personal = bool(rows) or self._has_records(db, user_id)
+        if not personal:
+            # new student: the job never saw them
+            rows = db.execute("SELECT course FROM recommendations WHERE user_id = ? ORDER BY rank",
+                              (POPULAR,)).fetchall()
+        found = Recommendations(tuple(r[0] for r in rows), personal)
+        self._cache.put(user_id, found, version)
+        return found
+
+    @staticmethod
+    def _has_records(db, user_id):
+        """Whether user_id has attendance or marks, i.e. was in the job's
+        matrix; one with no rows then has taken every course."""
+        return bool(db.execute("""
+            SELECT EXISTS (SELECT 1 FROM attendance_summary WHERE user_id = ?)
+                OR EXISTS (SELECT 1 FROM marks_summary WHERE user_id = ?)
+        """, (user_id, user_id)).fetchone()[0])
+
+    def stats(self):
+        return self._cache.stats()
+
+
+def main(argv=None):
+    import app
+
+    parser = argparse.ArgumentParser(description="Rebuild the course recommendations.")
+    parser.add_argument("--db", default=app.DATABASE, help="database file (default: %(default)s)")
+    parser.add_argument("--top", type=int, default=TOP_K, help="courses stored per student")
+    args = parser.parse_args(argv)
+    if not AVAILABLE:
+        parser.error("needs numpy: pip install numpy")
+
+    app.DATABASE = args.db
+    app.init_db()
+    db = connect(args.db)
+    start = time.perf_counter()
+    students, courses = build(db, args.top)
+    db.close()
+    print("recommendations for %d students over %d courses in %.1fs"
+          % (students, courses, time.perf_counter() - start))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,296 @@
+"""Attendance and marks, with per-student summaries kept up to date.
+
+Raw history lives in `attendance` (one row per student, course and day)
+and `marks` (one row per student, course and assessment). Dashboards and
+the chatbot need a student's totals on every page view, so these are kept
+in attendance_summary and marks_summary instead of being aggregated from
+the raw rows each time. Triggers apply each insert, update and delete to
+the summary as a delta. Every writer (the app, imports, a hand-edited
+database) keeps the summaries right, and reading them is one primary-key
+lookup.
+
+marks_summary.recent holds the last RECENT_SCORES percentages, newest
+first, as a JSON array. A trigger refreshes it from the (user_id, taken_on)
+index, so that costs RECENT_SCORES index rows per change.
+
+SummaryCache keeps recently read summaries in memory for the chatbot, so a
+student chatting away does not cost a query per message. Triggers on the
+summaries stamp each changed student in summary_changes with an increasing
+seq; the cache reads the stamps newer than the last it saw every few
+seconds and drops those students, whichever process wrote the change.
+"""
+import json
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+# Scores kept in marks_summary.recent. The triggers are created with this
+# value; run rebuild_summaries() after changing it on an existing database.
+RECENT_SCORES = 5
+
+Summary = namedtuple(
+    "Summary",
+    "sessions present attendance_percent assessments average_percent recent last_assessed")
+
+_RECENT = """
+    (SELECT json_group_array(percent) FROM (
+        SELECT round(100.0 * score / max_score, 2) AS percent FROM marks
+        WHERE user_id = %%s ORDER BY taken_on DESC, id DESC LIMIT %d))
+""" % RECENT_SCORES
+
+_LAST = """
+    (SELECT max(taken_on) FROM marks WHERE user_id = %s)
+"""
+
+
+def init_records(db):
+    """Create the tables, indexes and triggers if missing (part of init_db)."""
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS attendance (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL REFERENCES users (id),
+            course TEXT NOT NULL,
+            day TEXT NOT NULL,
+            present INTEGER NOT NULL CHECK (present IN (0, 1)),
+            UNIQUE (user_id, course, day)
+        )
+    """)
+    db.execute("CREATE INDEX IF NOT EXISTS idx_attendance_user_day ON attendance (user_id, day)")
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS marks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL REFERENCES users (id),
+            course TEXT NOT NULL,
+            assessment TEXT NOT NULL,
+            score REAL NOT NULL,
+            max_score REAL NOT NULL CHECK (max_score > 0),
+            taken_on TEXT NOT NULL,
+            CHECK (score >= 0 AND score <= max_score),
+            UNIQUE (user_id, course, assessment)
+        )
+    """)
+    db.execute("CREATE INDEX IF NOT EXISTS idx_marks_user_taken ON marks (user_id, taken_on)")
+
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS attendance_summary (
+            user_id INTEGER PRIMARY KEY REFERENCES users (id),
+            sessions INTEGER NOT NULL DEFAULT 0,
+            present INTEGER NOT NULL DEFAULT 0,
+            percent REAL GENERATED ALWAYS AS
+                (CASE WHEN sessions > 0 THEN round(100.0 * present / sessions, 2) END) VIRTUAL
+        )
+    """)
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS marks_summary (
+            user_id INTEGER PRIMARY KEY REFERENCES users (id),
+            assessments INTEGER NOT NULL DEFAULT 0,
+            percent_total REAL NOT NULL DEFAULT 0,
+            average REAL GENERATED ALWAYS AS
+                (CASE WHEN assessments > 0 THEN round(percent_total / assessments, 2) END) VIRTUAL,
+            recent TEXT NOT NULL DEFAULT '[]',
+            last_assessed TEXT
+        )
+    """)
+
+    # attendance: +1 session (and +1 present) per row
+    add_attendance = """
+        INSERT INTO attendance_summary (user_id, sessions, present)
+        VALUES (new.user_id, 1, new.present)
+        ON CONFLICT (user_id) DO UPDATE
+        SET sessions = sessions + 1, present = present + excluded.present;
+    """
+    remove_attendance = """
+        UPDATE attendance_summary SET sessions = sessions - 1, present = present - old.present
+        WHERE user_id = old.user_id;
+    """
+    db.execute("""
+        CREATE TRIGGER IF NOT EXISTS attendance_summary_insert AFTER INSERT ON attendance
+        BEGIN %s END
+    """ % add_attendance)
+    db.execute("""
+        CREATE TRIGGER IF NOT EXISTS attendance_summary_delete AFTER DELETE ON attendance
+        BEGIN %s END
+    """ % remove_attendance)
+    db.execute("""
+        CREATE TRIGGER IF NOT EXISTS attendance_summary_update
+        AFTER UPDATE OF user_id, present ON attendance
+        BEGIN %s %s END
+    """ % (remove_attendance, add_attendance))
+
+    # marks: running count and sum of percentages, plus the latest scores
+    add_mark = """
+        INSERT INTO marks_summary (user_id, assessments, percent_total)
+        VALUES (new.user_id, 1, 100.0 * new.score / new.max_score)
+        ON CONFLICT (user_id) DO UPDATE
+        SET assessments = assessments + 1, percent_total = percent_total + excluded.percent_total;
+        UPDATE marks_summary SET recent = %s, last_assessed = %s WHERE user_id = new.user_id;
+    """ % (_RECENT % "new.user_id", _LAST % "new.user_id")
+    remove_mark = """
+        UPDATE marks_summary
+        SET assessments = assessments - 1,
+            percent_total = CASE WHEN assessments > 1
+                                 THEN percent_total - 100.0 * old.score / old.max_score ELSE 0 END,
+            recent = %s,
+            last_assessed = %s
+        WHERE user_id = old.user_id;
+    """ % (_RECENT % "old.user_id", _LAST % "old.user_id")
+    db.execute("""
+        CREATE TRIGGER IF NOT EXISTS marks_summary_insert AFTER INSERT ON marks
+        BEGIN %s END
+    """ % add_mark)
+    db.execute("""
+        CREATE TRIGGER IF NOT EXISTS marks_summary_delete AFTER DELETE ON marks
+        BEGIN %s END
+    """ % remove_mark)
+    db.execute("""
+        CREATE TRIGGER IF NOT EXISTS marks_summary_update
+        AFTER UPDATE OF user_id, score, max_score, taken_on ON marks
+        BEGIN %s %s END
+    """ % (remove_mark, add_mark))
+
+
+    # change stamps for SummaryCache
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS summary_changes (
+            user_id INTEGER PRIMARY KEY,
+            seq INTEGER NOT NULL
+        )
+    """)
+    db.execute("CREATE INDEX IF NOT EXISTS idx_summary_changes_seq ON summary_changes (seq)")
+    for table in ("attendance_summary", "marks_summary"):
+        for event in ("INSERT", "UPDATE"):
+            db.execute("""
+                CREATE TRIGGER IF NOT EXISTS summary_changes_%s_%s AFTER %s ON %s
+                BEGIN
+                    INSERT INTO summary_changes (user_id, seq)
+                    VALUES (new.user_id, (SELECT coalesce(max(seq), 0) + 1 FROM summary_changes))
+                    ON CONFLICT (user_id) DO UPDATE SET seq = excluded.seq;
+                END
+            """ % (table, event.lower(), event, table))
+
+
+def rebuild_summaries(db):
+    """Recompute every summary from the raw rows, e.g. after RECENT_SCORES
+    changed or rows were written with the triggers missing."""
+    with db:
+        db.execute("DELETE FROM attendance_summary")
+        db.execute("""
+            INSERT INTO attendance_summary (user_id, sessions, present)
+            SELECT user_id, count(*), sum(present) FROM attendance GROUP BY user_id
+        """)
+        db.execute("DELETE FROM marks_summary")
+        db.execute("""
+            INSERT INTO marks_summary (user_id, assessments, percent_total, last_assessed)
+            SELECT user_id, count(*), sum(100.0 * score / max_score), max(taken_on)
+            FROM marks GROUP BY user_id
+        """)
+        db.execute("UPDATE marks_summary SET recent = %s" % (_RECENT % "marks_summary.user_id"))
+
+
+def student_summary(db, user_id):
+    """Return a student's Summary; a student with no records gets zeros."""
+    a = db.execute("SELECT sessions, present, percent FROM attendance_summary WHERE user_id = ?",
+                   (user_id,)).fetchone()
+    m = db.execute("""
+        SELECT assessments, average, recent, last_assessed FROM marks_summary WHERE user_id = ?
+    """, (user_id,)).fetchone()
+    return Summary(
+        sessions=a["sessions"] if a else 0,
+        present=a["present"] if a else 0,
+        attendance_percent=a["percent"] if a else None,
+        assessments=m["assessments"] if m else 0,
+        average_percent=m["average"] if m else None,
+        recent=json.loads(m["recent"]) if m else [],
+        last_assessed=m["last_assessed"] if m else None,
+    )
+
+
+class SummaryCache:
+    """Read-through cache of student summaries, each kept for at most `ttl`
+    seconds.
+
+    At most every check_every seconds, get() looks in summary_changes for
+    students whose attendance or marks changed since its last look, by any
+    writer (the app, importer.py, another worker), and drops them. Like
+    ResponseCache, a read that started before an invalidation is not cached.
+    """
+
+    def __init__(self, maxsize=4096, ttl=60.0, check_every=2.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.check_every = check_every
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._seq = None
+        self._checked = None
+
+    def _check(self, db, now):
+        """Drop the students changed since the last check."""
+        with self._lock:
+            if self._checked is not None and now - self._checked < self.check_every:
+                return
+            self._checked = now
+            seq = self._seq
+        if seq is None:
+            # nothing is cached yet, so only the current position matters
+            changed = []
+            seq = db.execute("SELECT coalesce(max(seq), 0) FROM summary_changes").fetchone()[0]
+        else:
+            rows = db.execute("SELECT user_id, seq FROM summary_changes WHERE seq > ? ORDER BY seq",
+                              (seq,)).fetchall()
+            changed = [r[0] for r in rows]
+            if rows:
+                seq = rows[-1][1]
+        with self._lock:
+            self._seq = max(seq, self._seq or 0)
+            if len(changed) >= len(self._data):
+                self._data.clear()
+            else:
+                for user_id in changed:
+                    self._data.pop(user_id, None)
+            if changed:
+                self.version += 1
+
+    def get(self, db, user_id):
+        """Return user_id's Summary, reading it from db if needed."""
+        now = time.monotonic()
+        self._check(db, now)
+        with self._lock:
+            entry = self._data.get(user_id)
+            if entry is not None and entry[0] > now:
+                self.hits += 1
+                self._data.move_to_end(user_id)
+                return entry[1]
+            self.misses += 1
+            version = self.version
+        summary = student_summary(db, user_id)
+        with self._lock:
+            if version == self.version and self.maxsize > 0 and self.ttl > 0:
+                self._data[user_id] = (now + self.ttl, summary)
+                self._data.move_to_end(user_id)
+                while len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)
+        return summary
+
+    def invalidate(self, user_id=None):
+        """Forget one student's summary, or everyone's."""
+        with self._lock:
+            if user_id is None:
+                self._data.clear()
+            else:
+                self._data.pop(user_id, None)
+            self.version += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,213 @@
+"""Student risk scores from attendance and marks.
+
+    python risk.py                   # rescore students whose records changed
+    python risk.py --full            # rescore everyone (e.g. after changing MODEL)
+    python risk.py --model model.json
+
+Each student's features come from the summary tables in records.py, a
+chunk of students at a time, into numpy arrays: attendance rate, average
+mark, and the trend of their recent marks (least-squares slope per
+assessment). A logistic model scores the whole chunk in one matrix product
+and the scores are upserted with one executemany.
+
+Triggers on the summary tables record every student whose inputs changed
+in risk_changes. A normal run only rescores those students.
+
+Needs numpy.
+"""
+import argparse
+import json
+import sys
+import time
+
+from db import connect
+
+try:
+    import numpy as np
+except ImportError:  # optional dependency
+    np = None
+
+AVAILABLE = np is not None
+
+# Feature order of MODEL["weights"]; rates are 0..1, trend is per assessment.
+FEATURES = ("attendance", "average", "trend")
+# Used when a student has no data for a feature yet.
+DEFAULTS = {"attendance": 0.85, "average": 0.6, "trend": 0.0}
+# Logistic model: risk = 1 / (1 + exp(-(bias + weights . features))). Low
+# attendance and marks, and falling marks, raise the risk.
+MODEL = {"bias": 6.0, "weights": {"attendance": -5.0, "average": -5.0, "trend": -8.0}}
+# Risk at or above which a student is in the band.
+BANDS = (("high", 0.7), ("medium", 0.4))
+
+_SELECT = """
+    SELECT u.id, a.percent, m.average, m.recent
+    FROM users u
+    LEFT JOIN attendance_summary a ON a.user_id = u.id
+    LEFT JOIN marks_summary m ON m.user_id = u.id
+    WHERE (a.user_id IS NOT NULL OR m.user_id IS NOT NULL) AND %s
+"""
+
+
+def init_risk(db):
+    """Create the score and change tables and their triggers if missing
+    (part of init_db; needs the tables from records.py)."""
+    exists = db.execute("SELECT 1 FROM sqlite_master WHERE name = 'risk_changes'").fetchone()
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS risk_scores (
+            user_id INTEGER PRIMARY KEY REFERENCES users (id),
+            score REAL NOT NULL,
+            band TEXT NOT NULL,
+            attendance REAL NOT NULL,
+            average REAL NOT NULL,
+            trend REAL NOT NULL,
+            scored_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now'))
+        )
+    """)
+    db.execute("CREATE INDEX IF NOT EXISTS idx_risk_scores_score ON risk_scores (score)")
+    db.execute("CREATE TABLE IF NOT EXISTS risk_changes (user_id INTEGER PRIMARY KEY)")
+    for table in ("attendance_summary", "marks_summary"):
+        for event in ("INSERT", "UPDATE"):
+            db.execute("""
+                CREATE TRIGGER IF NOT EXISTS risk_changes_%s_%s AFTER %s ON %s
+                BEGIN
+                    INSERT INTO risk_changes (user_id) SELECT new.user_id
+                    WHERE NOT EXISTS (SELECT 1 FROM risk_changes WHERE user_id = new.user_id);
+                END
+            """ % (table, event.lower(), event, table))
+    if not exists:
+        # students with records from before scoring existed
+        db.execute("INSERT OR IGNORE INTO risk_changes SELECT user_id FROM attendance_summary")
+        db.execute("INSERT OR IGNORE INTO risk_changes SELECT user_id FROM marks_summary")
+
+
+def features(rows):
+    """Return (user ids, n x len(FEATURES) float array) for fetched rows."""
+    n = len(rows)
+    ids = np.fromiter((r[0] for r in rows), dtype=np.int64, count=n)
+    attendance = np.array([r[1] if r[1] is not None else np.nan for r in rows], dtype=float) / 100
+    average = np.array([r[2] if r[2] is not None else np.nan for r in rows], dtype=float) / 100
+
+    # recent marks, newest first, padded with NaN to a rectangle
+    recent = [json.loads(r[3]) if r[3] else [] for r in rows]
+    width = max((len(x) for x in recent), default=0)
+    y = np.full((n, max(width, 1)), np.nan)
+    for i, x in enumerate(recent):
+        y[i, :len(x)] = x
+    # least-squares slope over assessment number (oldest = 0)
+    seen = ~np.isnan(y)
+    counts = seen.sum(axis=1)
+    y = np.where(seen, y / 100, 0.0)
+    t = np.where(seen, counts[:, None] - 1 - np.arange(y.shape[1])[None, :], 0.0)
+    denominator = np.maximum(counts, 1)[:, None]
+    dt = np.where(seen, t - t.sum(axis=1, keepdims=True) / denominator, 0.0)
+    dy = np.where(seen, y - y.sum(axis=1, keepdims=True) / denominator, 0.0)
+    spread = (dt * dt).sum(axis=1)
+    trend = np.full(n, np.nan)
+    fit = counts >= 2
+    trend[fit] = (dt * dy).sum(axis=1)[fit] / spread[fit]
+
+    x = np.column_stack([attendance, average, trend])
+    for j, name in enumerate(FEATURES):
+        x[np.isnan(x[:, j]), j] = DEFAULTS[name]
+    return ids, x
+
+
+def score(x, model=MODEL):
+    """Risk in 0..1 for every row of a feature array."""
+    w = np.array([model["weights"][name] for name in FEATURES])
+    return 1.0 / (1.0 + np.exp(-(model["bias"] + x @ w)))
+
+
+def band(scores):
+    out = np.full(scores.shape, "low", dtype=object)
+    for name, cutoff in reversed(BANDS):
+        out[scores >= cutoff] = name
+    return out
+
+
+def _write(db, ids, x, risk):
+    labels = band(risk)
+    db.executemany("""
+        INSERT INTO risk_scores (user_id, score, band, attendance, average, trend)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (user_id) DO UPDATE SET
+            score = excluded.score, band = excluded.band, attendance = excluded.attendance,
+            average = excluded.average, trend = excluded.trend,
+            scored_at = strftime('%Y-%m-%d %H:%M:%f', 'now')
+    """, zip(ids.tolist(), risk.tolist(), labels.tolist(),
+             x[:, 0].tolist(), x[:, 1].tolist(), x[:, 2].tolist()))
+
+
+def score_all(db, model=MODEL, chunk=20000):
+    """Rescore every student with records; returns how many."""
+    # changes from here on are picked up by the next incremental run
+    with db:
+        db.execute("DELETE FROM risk_changes")
+    done = 0
+    last = 0
+    while True:
+        rows = db.execute(_SELECT % "u.id > ?" + " ORDER BY u.id LIMIT ?",
+                          (last, chunk)).fetchall()
+        if not rows:
+            return done
+        ids, x = features(rows)
+        with db:
+            _write(db, ids, x, score(x, model))
+        done += len(rows)
+        last = rows[-1][0]
+
+
+def score_changed(db, model=MODEL, chunk=900):
+    """Rescore the students in risk_changes; returns how many."""
+    done = 0
+    while True:
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            changed = [r[0] for r in db.execute(
+                "SELECT user_id FROM risk_changes ORDER BY user_id LIMIT ?", (chunk,))]
+            if not changed:
+                db.commit()
+                return done
+            marks = ",".join("?" * len(changed))
+            rows = db.execute(_SELECT % ("u.id IN (%s)" % marks), changed).fetchall()
+            if rows:
+                ids, x = features(rows)
+                _write(db, ids, x, score(x, model))
+            db.execute("DELETE FROM risk_changes WHERE user_id IN (%s)" % marks, changed)
+            db.commit()
+        except BaseException:
+            db.rollback()
+            raise
+        done += len(rows)
+
+
+def main(argv=None):
+    import app
+
+    parser = argparse.ArgumentParser(description="Score students' risk of falling behind.")
+    parser.add_argument("--db", default=app.DATABASE, help="database file (default: %(default)s)")
+    parser.add_argument("--full", action="store_true", help="rescore every student")
+    parser.add_argument("--model", help='JSON file like {"bias": ..., "weights": {...}}')
+    args = parser.parse_args(argv)
+    if not AVAILABLE:
+        parser.error("needs numpy: pip install numpy")
+    model = MODEL
+    if args.model:
+        with open(args.model, encoding="utf-8") as f:
+            model = json.load(f)
+
+    app.DATABASE = args.db
+    app.init_db()
+    db = connect(args.db)
+    start = time.perf_counter()
+    scored = score_all(db, model) if args.full else score_changed(db, model)
+    elapsed = time.perf_counter() - start
+    high = db.execute("SELECT count(*) FROM risk_scores WHERE band = 'high'").fetchone()[0]
+    db.close()
+    print("scored %d student(s) in %.1fs (%.0f/s); %d at high risk"
+          % (scored, elapsed, scored / elapsed if elapsed else 0, high))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,200 @@
+"""Full-text search over chat transcripts.
+
+    python search.py rebuild             # index messages stored before the index existed
+    python search.py rebuild --full      # re-index everything
+    python search.py query "account locked"
+
+chat_messages_fts is an FTS5 index over chat_messages.message. It stores
+no text of its own, and triggers keep it in step with every insert, update
+and delete. Messages that were already stored when the index was created
+are indexed by `rebuild`, one chunk per transaction. The app stays usable
+meanwhile, and an interrupted rebuild resumes where it stopped.
+"""
+import argparse
+import re
+import sys
+from collections import namedtuple
+
+from markupsafe import escape
+
+from db import connect
+
+Hit = namedtuple("Hit", "id user_id username sender created_at snippet")
+
+# Markers snippet() puts around matches, swapped for <mark> after escaping.
+_OPEN, _CLOSE = "\x02", "\x03"
+# Words of context shown around a match.
+SNIPPET_WORDS = 12
+
+# Rows between the old rows' bounds are waiting for rebuild; the triggers
+# must not try to remove them from the index, since they were never added.
+_INDEXED = ("NOT EXISTS (SELECT 1 FROM chat_search_backfill"
+            " WHERE old.id > done_id AND old.id <= high_id)")
+
+
+def init_search(db):
+    """Create the index and its triggers if missing (part of init_db)."""
+    exists = db.execute("SELECT 1 FROM sqlite_master WHERE name = 'chat_messages_fts'").fetchone()
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS chat_search_backfill (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            done_id INTEGER NOT NULL,
+            high_id INTEGER NOT NULL
+        )
+    """)
+    db.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS chat_messages_fts USING fts5 (
+            message,
+            content = 'chat_messages',
+            content_rowid = 'id',
+            tokenize = 'porter unicode61 remove_diacritics 2'
+        )
+    """)
+    db.execute("""
+        CREATE TRIGGER IF NOT EXISTS chat_messages_fts_insert AFTER INSERT ON chat_messages
+        BEGIN
+            INSERT INTO chat_messages_fts (rowid, message) VALUES (new.id, new.message);
+        END
+    """)
+    db.execute("""
+        CREATE TRIGGER IF NOT EXISTS chat_messages_fts_delete AFTER DELETE ON chat_messages
+        WHEN %s
+        BEGIN
+            INSERT INTO chat_messages_fts (chat_messages_fts, rowid, message)
+            VALUES ('delete', old.id, old.message);
+        END
+    """ % _INDEXED)
+    db.execute("""
+        CREATE TRIGGER IF NOT EXISTS chat_messages_fts_update AFTER UPDATE OF message ON chat_messages
+        WHEN %s
+        BEGIN
+            INSERT INTO chat_messages_fts (chat_messages_fts, rowid, message)
+            VALUES ('delete', old.id, old.message);
+            INSERT INTO chat_messages_fts (rowid, message) VALUES (new.id, new.message);
+        END
+    """ % _INDEXED)
+    if not exists:
+        # everything stored so far is left for rebuild
+        _mark_unindexed(db)
+
+
+def _mark_unindexed(db):
+    high = db.execute("SELECT coalesce(max(id), 0) FROM chat_messages").fetchone()[0]
+    db.execute("DELETE FROM chat_search_backfill")
+    if high:
+        db.execute("INSERT INTO chat_search_backfill (id, done_id, high_id) VALUES (1, 0, ?)",
+                   (high,))
+
+
+def backlog(db):
+    """Return (done_id, high_id) while old messages await indexing, else None."""
+    row = db.execute("SELECT done_id, high_id FROM chat_search_backfill").fetchone()
+    return (row[0], row[1]) if row else None
+
+
+def rebuild(db, chunk=5000, full=False, progress=None):
+    """Index the messages waiting for it, chunk rows per transaction, and
+    return how many were indexed. With full, the index is emptied and
+    every stored message is indexed again."""
+    if full:
+        with db:
+            db.execute("INSERT INTO chat_messages_fts (chat_messages_fts) VALUES ('delete-all')")
+            _mark_unindexed(db)
+    indexed = 0
+    while True:
+        with db:
+            pending = backlog(db)
+            if pending is None:
+                return indexed
+            done, high = pending
+            rows = [(r[0], r[1]) for r in db.execute(
+                "SELECT id, message FROM chat_messages WHERE id > ? AND id <= ? ORDER BY id LIMIT ?",
+                (done, high, chunk))]
+            if rows:
+                db.executemany("INSERT INTO chat_messages_fts (rowid, message) VALUES (?, ?)", rows)
+                done = rows[-1][0]
+            if not rows or done >= high:
+                db.execute("DELETE FROM chat_search_backfill")
+            else:
+                db.execute("UPDATE chat_search_backfill SET done_id = ?", (done,))
+        indexed += len(rows)
+        if progress is not None:
+            progress(indexed, done, high)
+
+
+def fts_query(text):
+    """Turn what a user typed into an FTS5 query: every word or "quoted
+    phrase" must occur. Returns "" when there is nothing to search for."""
+    terms = []
+    for phrase, word in re.findall(r'"([^"]*)"|(\S+)', text):
+        term = phrase or word
+        if re.search(r"\w", term):
+            terms.append('"%s"' % term.replace('"', '""'))
+    return " ".join(terms)
+
+
+def highlight(snippet):
+    """HTML-escape a snippet and wrap its matches in <mark>."""
+    return str(escape(snippet)).replace(_OPEN, "<mark>").replace(_CLOSE, "</mark>")
+
+
+def search(db, text, page=1, per_page=20, sender=None):
+    """Return (hits, more) for one page of messages matching text, best
+    match (BM25) first."""
+    query = fts_query(text)
+    if not query:
+        return [], False
+    sql = """
+        SELECT m.id, m.user_id, u.username, m.sender, m.created_at,
+               snippet(chat_messages_fts, 0, char(2), char(3), '…', ?) AS snippet
+        FROM chat_messages_fts
+        JOIN chat_messages m ON m.id = chat_messages_fts.rowid
+        LEFT JOIN users u ON u.id = m.user_id
+        WHERE chat_messages_fts MATCH ?
+    """
+    params = [SNIPPET_WORDS, query]
+    if sender is not None:
+        sql += " AND m.sender = ?"
+        params.append(sender)
+    sql += " ORDER BY chat_messages_fts.rank LIMIT ? OFFSET ?"
+    params += [per_page + 1, (page - 1) * per_page]
+    rows = db.execute(sql, params).fetchall()
+    hits = [Hit(r["id"], r["user_id"], r["username"], r["sender"], r["created_at"],
+                highlight(r["snippet"])) for r in rows[:per_page]]
+    return hits, len(rows) > per_page
+
+
+def main(argv=None):
+    import app
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default=app.DATABASE, help="database file (default: %(default)s)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("rebuild", help="index messages the index doesn't have yet")
+    p.add_argument("--chunk", type=int, default=5000, help="messages per transaction")
+    p.add_argument("--full", action="store_true", help="drop the index and index everything")
+    p = sub.add_parser("query", help="search messages")
+    p.add_argument("text")
+    p.add_argument("--page", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    app.DATABASE = args.db
+    app.init_db()
+    db = connect(args.db)
+    if args.command == "rebuild":
+        def progress(indexed, done, high):
+            print("indexed %d (up to id %d of %d)" % (indexed, done, high), file=sys.stderr)
+        print("indexed %d message(s)" % rebuild(db, args.chunk, args.full, progress))
+    else:
+        hits, more = search(db, args.text, args.page)
+        for hit in hits:
+            print("#%d %s %s (%s): %s" % (hit.id, hit.created_at, hit.username, hit.sender,
+                                          hit.snippet))
+        if more:
+            print("more: --page %d" % (args.page + 1))
+    db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
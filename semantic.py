@@ -0,0 +1,91 @@
+"""TF-IDF fallback for messages that match no keyword rule.
+
+Each rule becomes one document (its keywords plus its reply). The documents
+are turned into an L2-normalised sparse TF-IDF matrix once, when the rules
+are loaded; a message is then scored against every rule with a single
+sparse matrix-vector product and gets the best rule's reply if its cosine
+similarity clears the threshold.
+
+Needs numpy and scipy. Without them AVAILABLE is False and the app keeps
+the plain fallback reply.
+"""
+import math
+from collections import Counter
+
+from intents import tokenize
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:  # optional dependency
+    np = sparse = None
+
+AVAILABLE = np is not None
+
+# Words that carry no meaning on their own; left out of the vocabulary.
+STOPWORDS = frozenset("""
+a about all also an and any are as at back be been but by can could do does
+find for from get go good got had has have how i if in into is it its just
+know like make me more my need no not of on one or our please so some tell
+that the their them then there these they this to too use want was we what
+when where which who why will with would you your
+""".split())
+
+
+def terms(text):
+    return [tok for tok in tokenize(text) if tok not in STOPWORDS]
+
+
+class SemanticMatcher:
+    """Cosine similarity over TF-IDF vectors of the rules."""
+
+    def __init__(self, rules, threshold=0.35):
+        if not AVAILABLE:
+            raise RuntimeError("numpy and scipy are needed for the semantic fallback")
+        self.rules = sorted(rules, key=lambda r: r.id)
+        self.threshold = threshold
+
+        docs = []
+        for rule in self.rules:
+            # keywords count twice: they are what the rule is about
+            words = terms(" ".join(rule.keywords)) * 2 + terms(rule.response.lower())
+            docs.append(Counter(words))
+
+        df = Counter(word for doc in docs for word in doc)
+        self._vocab = {word: i for i, word in enumerate(sorted(df))}
+        n = len(docs)
+        self._idf = np.array([math.log((1 + n) / (1 + df[w])) + 1 for w in sorted(df)])
+
+        rows, cols, vals = [], [], []
+        for r, doc in enumerate(docs):
+            for word, count in doc.items():
+                rows.append(r)
+                cols.append(self._vocab[word])
+                vals.append((1 + math.log(count)) * self._idf[self._vocab[word]])
+        matrix = sparse.csr_matrix((vals, (rows, cols)), shape=(n, len(self._vocab)))
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        norms[norms == 0] = 1.0
+        # rules x vocab, each row unit length
+        self._matrix = (sparse.diags(1 / norms) @ matrix).tocsr()
+
+    def scores(self, t):
+        """Cosine similarity of t against every rule (None if t has no known words)."""
+        counts = Counter(w for w in terms(t) if w in self._vocab)
+        if not counts:
+            return None
+        cols = np.fromiter((self._vocab[w] for w in counts), dtype=np.intp, count=len(counts))
+        tf = 1 + np.log(np.fromiter(counts.values(), dtype=float, count=len(counts)))
+        query = np.zeros(len(self._vocab))
+        query[cols] = tf * self._idf[cols]
+        query /= np.linalg.norm(query)
+        return self._matrix @ query
+
+    def match(self, t):
+        """Return the closest rule for the normalized text t, or None."""
+        scores = self.scores(t)
+        if scores is None:
+            return None
+        best = int(scores.argmax())
+        if scores[best] < self.threshold:
+            return None
+        return self.rules[best]
@@ -0,0 +1,126 @@
+"""Find chatbot rules that earlier rules shadow.
+
+    python shadowing.py                  # report for intents.json
+    python shadowing.py --mode token     # same, for CHATBOT_MATCH_MODE=token
+    python shadowing.py --check          # exit 1 if a new rule can never match
+
+A keyword is shadowed when every message containing it is already answered
+by an earlier rule: "low attendance" by "attendance", "exam date" by
+"exam". Rules only ever look for keywords, so the keyword on its own is the
+hardest message to catch. If an earlier rule fires on that, it fires on every
+message containing the keyword. An "all" rule is tested the same way with
+its keywords scanned separately. The analysis is therefore exact, not a
+heuristic.
+
+A rule whose keywords are all shadowed can never answer. prune() drops those
+rules, and the dead keywords of partly shadowed ones, before the matcher is
+compiled; replies stay the same.
+"""
+import argparse
+import sys
+from collections import namedtuple
+
+from intents import MATCHERS, load_rules
+
+# (rule, keyword or None for an "all" rule, earlier rule that wins instead)
+Shadow = namedtuple("Shadow", "rule keyword by")
+
+# Rules that could already never match when the analyzer was added. They
+# are kept for their text, which the semantic fallback still uses. --check
+# fails for any unreachable rule not listed here.
+KNOWN_UNREACHABLE = frozenset([
+    9, 17, 18, 19, 23, 25, 28, 40, 41, 53, 54, 57, 58, 61, 80, 84, 85, 86,
+    87, 90, 96, 97, 103, 105, 109, 112, 117, 123, 124, 127, 131, 132, 134,
+    141, 143, 144, 149, 150, 151, 157, 159, 161, 163, 164, 165, 166, 167,
+    173, 175, 176, 177, 178, 179, 181, 190, 191, 193, 194, 195, 196, 197,
+    198, 199,
+])
+
+
+def analyze(rules, mode="substring"):
+    """Return (unreachable, partial).
+
+    unreachable maps each rule that can never match to its Shadows;
+    partial maps each rule that can match, but has dead keywords, to the
+    Shadows of those keywords. Both are ordered by rule id.
+    """
+    matcher = MATCHERS[mode](rules)
+    unreachable = {}
+    partial = {}
+    for rule in matcher.rules:
+        if rule.match == "all":
+            found = 0
+            for kw in rule.keywords:
+                found |= matcher.scan(kw)
+            by = matcher.winner(found)
+            if by is not rule:
+                unreachable[rule] = [Shadow(rule, None, by)]
+            continue
+        dead = []
+        for kw in rule.keywords:
+            by = matcher.winner(matcher.scan(kw))
+            if by is not rule:
+                dead.append(Shadow(rule, kw, by))
+        if len(dead) == len(rule.keywords):
+            unreachable[rule] = dead
+        elif dead:
+            partial[rule] = dead
+    return unreachable, partial
+
+
+def prune(rules, mode="substring"):
+    """Return rules without the unreachable ones and without dead keywords.
+
+    A matcher compiled from the result gives the same reply as one compiled
+    from `rules` for every message.
+    """
+    unreachable, partial = analyze(rules, mode)
+    pruned = []
+    for rule in rules:
+        if rule in unreachable:
+            continue
+        if rule in partial:
+            dead = {s.keyword for s in partial[rule]}
+            rule = rule._replace(keywords=tuple(kw for kw in rule.keywords if kw not in dead))
+        pruned.append(rule)
+    return pruned
+
+
+def describe(shadow):
+    what = ("%r is" % shadow.keyword if shadow.keyword is not None
+            else "its keywords together are")
+    return "%s caught by #%d %s" % (what, shadow.by.id, shadow.by.name)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path", nargs="?", default="intents.json",
+                        help="intents file (default: %(default)s)")
+    parser.add_argument("--mode", choices=sorted(MATCHERS), default="substring",
+                        help="matching mode to analyze (default: %(default)s)")
+    parser.add_argument("--check", action="store_true",
+                        help="exit 1 if a rule outside KNOWN_UNREACHABLE can never match")
+    args = parser.parse_args(argv)
+
+    rules = load_rules(args.path)
+    unreachable, partial = analyze(rules, args.mode)
+
+    for rule, shadows in unreachable.items():
+        print("#%d %s: unreachable; %s" % (rule.id, rule.name,
+                                           "; ".join(describe(s) for s in shadows)))
+    for rule, shadows in partial.items():
+        print("#%d %s: partly shadowed; %s" % (rule.id, rule.name,
+                                               "; ".join(describe(s) for s in shadows)))
+    print("%d rules: %d unreachable, %d partly shadowed"
+          % (len(rules), len(unreachable), len(partial)))
+
+    if args.check:
+        new = [rule for rule in unreachable if rule.id not in KNOWN_UNREACHABLE]
+        for rule in new:
+            print("error: rule #%d %s can never match" % (rule.id, rule.name), file=sys.stderr)
+        return 1 if new else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
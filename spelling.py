@@ -0,0 +1,121 @@
+"""Typo correction for chatbot messages against the rule keywords.
+
+Symmetric delete (as in SymSpell): every keyword word is stored under each
+string that can be made from it by deleting up to max_distance letters.
+A misspelled word is looked up under its own deletes. Any keyword word that
+shares a delete is a candidate, and only those few candidates get a real
+edit-distance check. As in SymSpell, only the first PREFIX_LENGTH letters
+are indexed, which keeps the number of deletes small for long words.
+Correcting a word therefore costs a few dozen dict probes, however many
+keywords there are. Words the bot itself uses in its responses, and those
+of the wordlists it is given (words.txt ships with the app), are taken as
+spelled right and left alone: "store" is a word, not a typo of "score".
+"""
+from intents import TOKEN_RE, tokenize
+
+# Words shorter than this are never corrected; short words are one edit
+# away from too many others ("snow" / "slow", "mars" / "marks").
+MIN_LENGTH = 5
+# Letters of each word that go into the delete index.
+PREFIX_LENGTH = 7
+
+
+def _deletes(word, distance):
+    """Every string made by deleting up to `distance` letters from word."""
+    found = {word}
+    edge = found
+    for _ in range(distance):
+        nxt = {w[:i] + w[i + 1:] for w in edge if len(w) > 1 for i in range(len(w))}
+        nxt -= found
+        found |= nxt
+        edge = nxt
+    return found
+
+
+def edit_distance(a, b, limit):
+    """Optimal string alignment distance (insertions, deletions,
+    substitutions and adjacent swaps), or limit + 1 once it exceeds limit."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    prev2 = None
+    prev = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            if (i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]):
+                cur[j] = min(cur[j], prev2[j - 2] + 1)
+        if min(cur) > limit:
+            return limit + 1
+        prev2, prev = prev, cur
+    return prev[-1] if prev[-1] <= limit else limit + 1
+
+
+def load_wordlist(path):
+    """Lower-cased words of a wordlist file (one per line, like words.txt
+    or /usr/share/dict/words); empty when there is no such file."""
+    try:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            return frozenset(w for w in (line.strip().lower() for line in f)
+                             if len(w) >= MIN_LENGTH and w.isalpha())
+    except OSError:
+        return frozenset()
+
+
+class SpellingCorrector:
+    """Maps misspelled words to the words used in a matcher's keywords."""
+
+    def __init__(self, rules, max_distance=2, known=()):
+        self.max_distance = max_distance
+        # word -> position of the first rule using it; ties between equally
+        # close corrections go to the higher-priority rule
+        self._rank = {}
+        for pos, rule in enumerate(sorted(rules, key=lambda r: r.id)):
+            for kw in rule.keywords:
+                for word in tokenize(kw):
+                    self._rank.setdefault(word, pos)
+        # real words that are not keywords, e.g. from the responses
+        self._known = set(known) | set(self._rank)
+        self._index = {}
+        for word in self._rank:
+            if len(word) >= MIN_LENGTH:
+                for d in _deletes(word[:PREFIX_LENGTH], max_distance):
+                    self._index.setdefault(d, []).append(word)
+
+    def allowed(self, word):
+        """Edits tolerated in word: one per four letters, up to max_distance."""
+        return min(self.max_distance, len(word) // 4)
+
+    def lookup(self, word):
+        """Return the closest keyword word to word, or None."""
+        limit = self.allowed(word)
+        if limit <= 0:
+            return None
+        best = None
+        best_key = None
+        seen = set()
+        for d in _deletes(word[:PREFIX_LENGTH], limit):
+            for candidate in self._index.get(d, ()):
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                dist = edit_distance(word, candidate, limit)
+                if dist > limit:
+                    continue
+                key = (dist, self._rank[candidate], candidate)
+                if best_key is None or key < best_key:
+                    best, best_key = candidate, key
+        return best
+
+    def _fix(self, m):
+        word = m.group()
+        if (len(word) < MIN_LENGTH or word in self._known
+                or (word.endswith("s") and word[:-1] in self._known)
+                or not word.isalpha()):
+            return word
+        return self.lookup(word) or word
+
+    def correct(self, t):
+        """Return the lower-cased text t with misspelled words replaced."""
+        return TOKEN_RE.sub(self._fix, t.replace("’", "'"))
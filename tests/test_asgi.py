@@ -0,0 +1,49 @@
+import asyncio
+
+import app
+import asgi
+
+
+def _handshake(tmp_path, monkeypatch, headers):
+    """Open /ws/chat as a logged-in student and hang up after the first
+    frame; returns the messages the server sent."""
+    monkeypatch.setattr(app, "DATABASE", str(tmp_path / "test.db"))
+    app.init_db()
+    cookie = app.app.session_interface.get_signing_serializer(app.app).dumps({"user_id": 1})
+    headers = [(b"host", b"chat.example.edu"), (b"cookie", b"session=" + cookie.encode())] + headers
+    scope = {"type": "websocket", "path": "/ws/chat", "headers": headers}
+    sent = []
+
+    async def receive():
+        if not sent:
+            return {"type": "websocket.connect"}
+        return {"type": "websocket.disconnect", "code": 1000}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(asgi.application(scope, receive, send))
+    return sent
+
+
+def test_cross_site_socket_is_refused(tmp_path, monkeypatch):
+    sent = _handshake(tmp_path, monkeypatch, [(b"origin", b"http://evil.example")])
+    assert sent == [{"type": "websocket.close", "code": asgi.CLOSE_FORBIDDEN}]
+    assert not asgi.sockets.open
+
+
+def test_same_site_socket_is_accepted(tmp_path, monkeypatch):
+    sent = _handshake(tmp_path, monkeypatch, [(b"origin", b"https://chat.example.edu")])
+    assert [m["type"] for m in sent] == ["websocket.accept", "websocket.send"]
+    assert not asgi.sockets.open
+
+
+def test_allowed_origins():
+    def scope(origin):
+        return {"headers": [(b"host", b"chat.example.edu:8000"), (b"origin", origin)]}
+
+    assert asgi.origin_allowed(scope(b"http://chat.example.edu:8000"))
+    assert asgi.origin_allowed({"headers": [(b"host", b"chat.example.edu")]})
+    assert not asgi.origin_allowed(scope(b"http://chat.example.edu"))
+    assert not asgi.origin_allowed(scope(b"null"))
+    assert not asgi.origin_allowed(scope(b"http://chat.example.edu:8000.evil.example"))
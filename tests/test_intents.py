@@ -0,0 +1,32 @@
+import os
+
+import pytest
+
+from intents import TokenMatcher, load_rules
+
+RULES = load_rules(os.path.join(os.path.dirname(os.path.dirname(__file__)), "intents.json"))
+
+
+@pytest.fixture(scope="module")
+def matcher():
+    return TokenMatcher(RULES)
+
+
+@pytest.mark.parametrize("message, intent", [
+    ("hi there", "greetings"),
+    ("assignments due", "assignments"),
+    ("exams", "exams"),
+    ("my marks", "marks"),
+])
+def test_whole_words_and_plurals_match(matcher, message, intent):
+    assert matcher.match(message).name == intent
+
+
+@pytest.mark.parametrize("message", [
+    "this",
+    "his grades",
+    "ais",
+    "cvs",
+])
+def test_short_words_are_not_plurals(matcher, message):
+    assert matcher.match(message) is None
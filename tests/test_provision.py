@@ -0,0 +1,33 @@
+import io
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import app
+from db import connect
+from provision import Provisioner, read_rows
+
+LINES = [
+    {"username": "amy", "password": "pw"},
+    [1, 2],
+    "amy",
+    {"username": "bob", "password": 123},
+    {"username": 5, "password": "pw"},
+    {"password": "pw"},
+    {"username": " cat ", "password": "pw"},
+]
+
+
+def test_bad_rows_are_counted_not_fatal(tmp_path, monkeypatch):
+    path = tmp_path / "students.jsonl"
+    path.write_text("\n".join(json.dumps(x) for x in LINES) + "\nnot json\n")
+    monkeypatch.setattr(app, "DATABASE", str(tmp_path / "test.db"))
+    app.init_db()
+    db = connect(app.DATABASE)
+
+    with ThreadPoolExecutor(2) as pool:
+        provisioner = Provisioner(db, pool, 2, "pbkdf2:sha256:1000", 100, out=io.StringIO())
+        provisioner.add_batch(list(read_rows(str(path), "jsonl")))
+        provisioner.flush()
+
+    assert (provisioner.created, provisioner.invalid) == (2, 6)
+    assert [r[0] for r in db.execute("SELECT username FROM users ORDER BY username")] == ["amy", "cat"]
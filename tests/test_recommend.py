@@ -0,0 +1,21 @@
+import app
+from db import connect
+from recommend import POPULAR, RecommendationCache, Recommendations
+
+
+def test_popular_courses_are_not_passed_off_as_personal(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "DATABASE", str(tmp_path / "test.db"))
+    app.init_db()
+    db = connect(app.DATABASE)
+    with db:
+        db.execute("INSERT INTO users (username, password) VALUES ('amy', 'x'), ('bob', 'x')")
+        db.executemany("INSERT INTO recommendations (user_id, rank, course, score) VALUES (?, ?, ?, ?)",
+                       [(POPULAR, 1, "python", 5), (POPULAR, 2, "java", 3), (1, 1, "sql", 0.9)])
+
+    cache = RecommendationCache()
+    assert cache.get(db, 1) == Recommendations(("sql",), True)
+    assert cache.get(db, 2) == Recommendations(("python", "java"), False)
+    with app.app.test_request_context():
+        monkeypatch.setattr(app, "recommendations", cache)
+        assert app.personal_reply(1, "course_recommendation", "").startswith("Based on your courses")
+        assert "most popular" in app.personal_reply(2, "course_recommendation", "")
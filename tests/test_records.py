@@ -0,0 +1,67 @@
+import random
+
+import app
+from db import connect
+from records import rebuild_summaries
+
+COURSES = ("python", "java", "sql")
+
+
+def summaries(db):
+    """Both summaries by student, skipping students left with no rows."""
+    attendance = {r[0]: r[1:] for r in db.execute(
+        "SELECT user_id, sessions, present, percent FROM attendance_summary WHERE sessions > 0")}
+    marks = {r[0]: (r[1], round(r[2], 6), r[3], r[4], r[5]) for r in db.execute("""
+        SELECT user_id, assessments, percent_total, average, recent, last_assessed
+        FROM marks_summary WHERE assessments > 0""")}
+    return attendance, marks
+
+
+def test_triggers_agree_with_a_rebuild(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "DATABASE", str(tmp_path / "test.db"))
+    app.init_db()
+    db = connect(app.DATABASE)
+    rng = random.Random(7)
+    users = range(1, 6)
+    with db:
+        db.executemany("INSERT INTO users (username, password) VALUES (?, 'x')",
+                       [("student%d" % u,) for u in users])
+        db.executemany(
+            "INSERT OR IGNORE INTO attendance (user_id, course, day, present) VALUES (?, ?, ?, ?)",
+            [(rng.choice(users), rng.choice(COURSES), "2024-03-%02d" % rng.randint(1, 28),
+              rng.randint(0, 1)) for _ in range(300)])
+        db.executemany("""
+            INSERT OR IGNORE INTO marks (user_id, course, assessment, score, max_score, taken_on)
+            VALUES (?, ?, ?, ?, 100, ?)""",
+            [(rng.choice(users), rng.choice(COURSES), "quiz %d" % rng.randint(1, 20),
+              rng.randint(0, 100), "2024-%02d-%02d" % (rng.randint(1, 12), rng.randint(1, 28)))
+             for _ in range(200)])
+
+    for _ in range(300):
+        table = rng.choice(("attendance", "marks"))
+        row = db.execute("SELECT id FROM %s ORDER BY random() LIMIT 1" % table).fetchone()[0]
+        change = rng.choice(("move", "edit", "delete"))
+        with db:
+            if change == "delete":
+                db.execute("DELETE FROM %s WHERE id = ?" % table, (row,))
+            elif change == "move":
+                db.execute("UPDATE OR IGNORE %s SET user_id = ? WHERE id = ?" % table,
+                           (rng.choice(users), row))
+            elif table == "attendance":
+                db.execute("UPDATE attendance SET present = 1 - present WHERE id = ?", (row,))
+            else:
+                db.execute("UPDATE marks SET score = ?, max_score = ?, taken_on = ? WHERE id = ?",
+                           (rng.randint(0, 50), rng.choice((50, 100)),
+                            "2024-%02d-%02d" % (rng.randint(1, 12), rng.randint(1, 28)), row))
+    # one student loses every row
+    with db:
+        db.execute("DELETE FROM attendance WHERE user_id = 5")
+        db.execute("DELETE FROM marks WHERE user_id = 5")
+
+    maintained = summaries(db)
+    assert maintained[0] and maintained[1]
+    assert 5 not in maintained[0] and 5 not in maintained[1]
+    emptied = db.execute("SELECT recent, last_assessed FROM marks_summary WHERE user_id = 5").fetchone()
+    assert emptied is None or tuple(emptied) == ("[]", None)
+    rebuild_summaries(db)
+    assert summaries(db) == maintained
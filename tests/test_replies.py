@@ -0,0 +1,33 @@
+import json
+import os
+
+import pytest
+
+from intents import EMPTY_REPLY, FALLBACK_REPLY, load_rules, normalize
+from knowledge import compile_rules
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RULES = load_rules(os.path.join(ROOT, "intents.json"))
+
+# Messages and the replies the original if-chain in simple_ai_response gave
+# them: every keyword alone, in a sentence, re-cased, cut short or inside a
+# longer word, each keyword after the next few in rule order (so priority
+# decides), random pairs and triples of keywords, and the bench corpus.
+with open(os.path.join(os.path.dirname(__file__), "baseline_replies.json"), encoding="utf-8") as f:
+    BASELINE = json.load(f)
+
+
+@pytest.mark.parametrize("prune_rules", [False, True])
+def test_replies_match_the_original_if_chain(prune_rules):
+    matcher = compile_rules(RULES, "substring", prune_rules=prune_rules).matcher
+    changed = []
+    for message, expected in BASELINE["messages"]:
+        t = normalize(message)
+        if not t:
+            reply = EMPTY_REPLY
+        else:
+            rule = matcher.match(t)
+            reply = rule.response if rule is not None else FALLBACK_REPLY
+        if reply != BASELINE["replies"][expected]:
+            changed.append(message)
+    assert not changed, "%d replies changed, e.g. %r" % (len(changed), changed[:5])
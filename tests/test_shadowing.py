@@ -0,0 +1,46 @@
+import os
+
+import pytest
+
+from intents import Rule, load_rules
+from shadowing import KNOWN_UNREACHABLE, analyze, main, prune
+
+INTENTS = os.path.join(os.path.dirname(os.path.dirname(__file__)), "intents.json")
+
+# "exam" catches every message "exam date" could; "fees refund" needs both
+# words, and "fees" always wins first.
+RULES = [
+    Rule(1, "exams", "any", ("exam",), "exams"),
+    Rule(2, "fees", "any", ("fees",), "fees"),
+    Rule(3, "exam_date", "any", ("exam date",), "exam date"),
+    Rule(4, "fee_refund", "all", ("fees", "refund"), "fee refund"),
+    Rule(5, "results", "any", ("exam result", "grades"), "results"),
+    Rule(6, "library", "any", ("library",), "library"),
+]
+
+
+@pytest.mark.parametrize("mode", ["substring", "token"])
+def test_no_new_unreachable_rules(mode):
+    unreachable, _ = analyze(load_rules(INTENTS), mode)
+    assert sorted(r.id for r in unreachable if r.id not in KNOWN_UNREACHABLE) == []
+
+
+def test_check_passes():
+    assert main([INTENTS, "--check"]) == 0
+
+
+@pytest.mark.parametrize("mode", ["substring", "token"])
+def test_shadowed_rules_are_found(mode):
+    unreachable, partial = analyze(RULES, mode)
+    assert {r.name: [s.by.name for s in shadows] for r, shadows in unreachable.items()} == {
+        "exam_date": ["exams"],
+        "fee_refund": ["fees"],
+    }
+    assert {r.name: [(s.keyword, s.by.name) for s in shadows]
+            for r, shadows in partial.items()} == {"results": [("exam result", "exams")]}
+
+
+def test_prune_keeps_only_reachable_keywords():
+    pruned = {r.name: r.keywords for r in prune(RULES)}
+    assert pruned == {"exams": ("exam",), "fees": ("fees",), "results": ("grades",),
+                      "library": ("library",)}
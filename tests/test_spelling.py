@@ -0,0 +1,58 @@
+import os
+
+import pytest
+
+from bench import FALLBACKS
+from intents import load_rules
+from knowledge import compile_rules
+from spelling import SpellingCorrector, load_wordlist
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RULES = load_rules(os.path.join(ROOT, "intents.json"))
+# only the shipped list: the OS one is missing on many machines
+WORDS = load_wordlist(os.path.join(ROOT, "words.txt"))
+
+
+def answer(compiled, message):
+    """The rule the app's keyword path picks: as typed, then corrected."""
+    rule = compiled.matcher.match(message)
+    if rule is None:
+        rule = compiled.matcher.match(compiled.spelling.correct(message))
+    return rule.name if rule else None
+
+
+@pytest.fixture(scope="module", params=["substring", "token"])
+def compiled(request):
+    return compile_rules(RULES, request.param, prune_rules=True, known_words=WORDS)
+
+
+@pytest.mark.parametrize("message, intent", [
+    ("when is my asignment due", "assignments"),
+    ("the sylabus please", "exam_syllabus"),
+])
+def test_typos_are_corrected(compiled, message, intent):
+    assert answer(compiled, message) == intent
+
+
+@pytest.mark.parametrize("message", FALLBACKS + [
+    "weather on mars",
+    "it will snow",
+    "i lost my hand",
+    "i want to quit",
+    "the store is closed",
+    "walk along the shore",
+    "a curse on it",
+    "the lease ends in june",
+])
+def test_ordinary_words_still_fall_back(compiled, message):
+    assert answer(compiled, message) is None
+
+
+def test_short_words_are_left_alone(compiled):
+    assert compiled.spelling.correct("exit the app") == "exit the app"
+
+
+def test_wordlist_words_are_not_typos():
+    rules = compile_rules(RULES, "token").matcher.rules
+    assert SpellingCorrector(rules, known=WORDS).correct("my store is low") == "my store is low"
+    assert SpellingCorrector(rules, known=WORDS).correct("my scroe is low") == "my score is low"